@@ -1,7 +1,6 @@
 import streamlit as st
-from functions import init_db, display_first_aid_guide_auto_scroll_with_manual, connect_to_google_sheet, log_scan_activity, create_qr_code, get_patient_by_id, insert_or_update_patient, validate_phone_and_emergency_contact, validate_phone, validate_nin, validate_emergency_contact
+from functions import init_db, display_first_aid_guide_auto_scroll_with_manual, get_worksheets, log_scan_activity, create_qr_code, get_patient_by_id, insert_or_update_patient, validate_phone_and_emergency_contact, validate_phone, validate_nin, validate_emergency_contact, load_first_aid_image
 import warnings
-from PIL import Image
 
 warnings.filterwarnings("ignore")
 
@@ -9,18 +8,16 @@ warnings.filterwarnings("ignore")
 st.set_page_config(
     page_title="Emergency Medical Information System", layout="wide")
 
-SHEET_ID = st.secrets.google_sheet_credentials.SHEET_ID
-
 # --------------------------
 # Main Logic
 # --------------------------
 
-# Initialize the SQLite database and create the 'patients' table
+# Initialize the SQLite database and create the 'patients' table (runs once per process)
 init_db()
 
 # Google Sheets setup for "VisionX" Google Sheet with two sheets: 'patients' and 'scan_activities'
-patient_worksheet = connect_to_google_sheet(SHEET_ID, 'Patients')
-scan_worksheet = connect_to_google_sheet(SHEET_ID, 'Scan Activities')
+# The authorized client and spreadsheet are cached, so reruns reuse the same connection
+patient_worksheet, scan_worksheet = get_worksheets()
 
 # Parse the query parameters from the URL
 query_params = st.query_params
@@ -41,43 +38,31 @@ if "patient_id" in query_params:
         # Column 1: Display patient information
         with col1:
             # Patient name
-            st.subheader(f"Medical Information for {patient[2]}")
-            st.write(f"**Age:** {patient[3]}")
-            st.write(f"**Phone Number:** {patient[5]}")
-            st.write(f"**Emergency Contact:** {patient[6]}")
-            st.write(f"**Genotype:** {patient[7]}")
-            st.write(f"**Blood Type:** {patient[8]}")
-
-            # Handle case where allergies are None
-            allergies = patient[9] if patient[9] is not None else ""
-
-            # Display the allergies as a list
+            st.subheader(f"Medical Information for {patient['name']}")
+            st.write(f"**Age:** {patient['age']}")
+            st.write(f"**Phone Number:** {patient['phone']}")
+            st.write(f"**Emergency Contact:** {patient['emergency_contact']}")
+            st.write(f"**Genotype:** {patient['genotype']}")
+            st.write(f"**Blood Type:** {patient['blood_type']}")
+
+            # Display the allergies as a list (rendered to markdown when the record was saved)
             st.write("**Allergies:**")
-            allergy_entries = allergies.split(',')
-            st.markdown(
-                '\n'.join(f"- {entry.strip()}" for entry in allergy_entries if entry.strip()))
-
-            # Handle cases where medical history is None
-            medical_history = patient[10] if patient[10] is not None else ""
+            st.markdown(patient['allergies_md'] or "")
 
             # Display the medical history as a list
             st.write("**Medical History:**")
-            medical_history_entries = medical_history.split(',')
-            st.markdown('\n'.join(
-                f"- {entry.strip()}" for entry in medical_history_entries if entry.strip()))
+            st.markdown(patient['medical_history_md'] or "")
 
             # Log the scan activity without IP
-            log_scan_activity(patient[1], scan_worksheet)  # patient_uuid
+            log_scan_activity(patient['uuid'], scan_worksheet)
 
             # Display the first aid guide with auto-scroll and manual control
             display_first_aid_guide_auto_scroll_with_manual()
 
         # Column 2: Display the image
         with col2:
-            image_path = '/mnt/data/image.png'  # Path to the uploaded image
-            image = Image.open(image_path)  # Load the image
-            # Display the image with caption
-            st.image(image, caption="First Aid in Action",
+            # Display the cached image bytes with caption (no Pillow decode per rerun)
+            st.image(load_first_aid_image(), caption="First Aid in Action",
                      use_column_width=True)
 
     else:
@@ -118,6 +103,10 @@ else:
 
 
     if submitted:
+        # A new submission replaces the QR code kept from the previous one
+        for key in ('patient_id', 'qr_link', 'qr_bytes', 'qr_file_name'):
+            st.session_state.pop(key, None)
+
         if consent:
             if not validate_nin(nin_input):
                 st.error("NIN must be exactly 11 digits.")
@@ -143,29 +132,39 @@ else:
 
                     # Generate the QR code based on the qr_link
                     qr_code = create_qr_code(
-                        qr_link, f"QR Codes/{name}_{patient_id}.png")
-
-                    # Display the generated QR code
-                    st.image(
-                        qr_code, caption="Scan this QR code to view medical information", width=300)
-
-                    # Allow users to download the QR code image
-                    st.download_button(
-                        label="Download QR Code",
-                        data=qr_code,
-                        file_name=f"{name}_{patient_id}.png",
-                        mime="image/png"
-                    )
+                        qr_link, f"QR Codes/{name}_{patient_id}.png") if qr_link else None
 
-                    # Show the QR URL (always points to the patient’s medical record)
-                    st.write(f"QR Code URL: {qr_link}")
+                    # Keep the result so later reruns skip the DB write, Sheets sync and QR encode
+                    if qr_code is not None:
+                        st.session_state.update({
+                            'patient_id': patient_id,
+                            'qr_link': qr_link,
+                            'qr_bytes': qr_code.getvalue(),
+                            'qr_file_name': f"{name}_{patient_id}.png",
+                        })
 
         else:
             st.error("You must provide consent to submit the form.")
 
-            # the footer and more information
-        st.markdown(
-            """<p style="color:white ; text-align:center;font-size:15px;"> Copyright | VisionX 2024(c) </p>
-            """,
-            unsafe_allow_html=True,
+    # Display the generated QR code, including on reruns such as the download click
+    if 'qr_bytes' in st.session_state:
+        st.image(
+            st.session_state.qr_bytes, caption="Scan this QR code to view medical information", width=300)
+
+        # Allow users to download the QR code image
+        st.download_button(
+            label="Download QR Code",
+            data=st.session_state.qr_bytes,
+            file_name=st.session_state.qr_file_name,
+            mime="image/png"
         )
+
+        # Show the QR URL (always points to the patient’s medical record)
+        st.write(f"QR Code URL: {st.session_state.qr_link}")
+
+    # the footer and more information
+    st.markdown(
+        """<p style="color:white ; text-align:center;font-size:15px;"> Copyright | VisionX 2024(c) </p>
+        """,
+        unsafe_allow_html=True,
+    )
@@ -1,17 +1,211 @@
 import sqlite3
 import streamlit as st
+import streamlit.components.v1 as components
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-import pandas as pd
 import segno
 from io import BytesIO
 import os
+import pathlib
 import uuid
 import time
-import re
+import hashlib
+import tempfile
+import threading
+import queue
+import atexit
+import functools
+import itertools
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+@functools.cache
+def _sheet_id():
+    """
+    Returns the VisionX spreadsheet ID from st.secrets. Read on first use rather than at
+    import, because the first st.secrets access parses the secrets files and installs their
+    file watchers, which takes several hundred milliseconds when a secrets path is missing.
+    """
+    return st.secrets.google_sheet_credentials.SHEET_ID
+
+# Assets shipped next to this module, resolved once so they load from any working directory
+_APP_DIR = pathlib.Path(__file__).resolve().parent
+FIRST_AID_IMAGE_PATH = _APP_DIR / 'Heart Compression.png'
+
+# Separators accepted in phone input; deleted with one C-level bytes.translate pass
+_PHONE_SEPARATORS = b' -().\t'
+
+# Patient columns mirrored to the 'Patients' sheet (the *_md render columns stay local)
+_PATIENT_SHEET_COLUMNS = ('id, uuid, name, age, nin, phone, emergency_contact, genotype, blood_type, '
+                          'allergies, medical_history, patient_id, qr_link')
+
+# Columns an UPSERT overwrites when the NIN or phone number is already registered;
+# uuid, nin, phone and patient_id keep their original values
+_PATIENT_UPSERT_SET = ('name = excluded.name, age = excluded.age, allergies = excluded.allergies, '
+                       'medical_history = excluded.medical_history, emergency_contact = excluded.emergency_contact, '
+                       'genotype = excluded.genotype, blood_type = excluded.blood_type, qr_link = excluded.qr_link, '
+                       'allergies_md = excluded.allergies_md, medical_history_md = excluded.medical_history_md')
+
+# Patient write statements, built once at import so every call passes the identical string
+# and hits the connection's prepared-statement cache without re-formatting the SQL
+_PATIENT_INSERT_SQL = '''
+    INSERT INTO patients (uuid, name, age, nin, phone, emergency_contact, genotype, blood_type, allergies, medical_history, patient_id, qr_link,
+                          allergies_md, medical_history_md)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+_PATIENT_UPSERT_SQL = f'''{_PATIENT_INSERT_SQL}
+    ON CONFLICT(nin) DO UPDATE SET {_PATIENT_UPSERT_SET}
+    ON CONFLICT(phone) DO UPDATE SET {_PATIENT_UPSERT_SET}
+    RETURNING {_PATIENT_SHEET_COLUMNS}
+'''
+_PATIENT_ROWS_AFTER_SQL = f'SELECT {_PATIENT_SHEET_COLUMNS} FROM patients WHERE id > ? ORDER BY id'
+
+# The scan view reads only the fields it shows, with the lists pre-rendered to markdown,
+# addressable by name through sqlite3.Row
+_PATIENT_VIEW_SQL = '''
+    SELECT uuid, name, age, phone, emergency_contact, genotype, blood_type, allergies_md, medical_history_md
+    FROM patients WHERE patient_id = ?
+'''
+
+# Scan and log statements, shared by the background writers and their exit flushes
+_SCAN_INSERT_SQL = 'INSERT INTO scan_activities (patient_uuid, timestamp) VALUES (?, ?)'
+_LOG_INSERT_SQL = 'INSERT INTO logs (timestamp, level, message) VALUES (?, ?, ?)'
+_LOG_ROWS_AFTER_SQL = 'SELECT id, timestamp, level, message FROM logs WHERE id > ? ORDER BY id LIMIT ?'
+
+# Public URL encoded in each patient's QR code
+QR_LINK_TEMPLATE = "https://frequently-beloved-robin.ngrok-free.app/?patient_id={patient_id}"
+
+# Pixels per QR module. Codes are printed and scanned in emergencies, so they keep a large
+# scale and the 'h' error correction level rather than trading them for encode speed
+QR_SCALE = 10
+
+# Number of query results fetch_db_rows keeps while the database is unchanged
+DB_ROWS_CACHE_SIZE = 8
+
+# Lifetime in seconds of the cached spreadsheet and worksheet handles, after which their
+# metadata (grid size, sheet ids) is fetched again
+SHEETS_HANDLE_TTL = 3600
+
+# Height in pixels of the scrollable first aid guide, and the seconds between auto-scroll steps
+FIRST_AID_GUIDE_HEIGHT = 400
+FIRST_AID_SCROLL_SECONDS = 3
+
+# After an outage-like Sheets failure, Sheets calls are skipped for SHEETS_COOLDOWN seconds,
+# so an unreachable API costs one timeout per window instead of one per write
+SHEETS_COOLDOWN = 60.0
+_sheets_down_until = float('-inf')
+
+# Failures that mean Sheets is unreachable or refusing requests (requests' network errors
+# subclass OSError)
+_SHEETS_OUTAGE_ERRORS = (gspread.exceptions.APIError, OSError)
+
+# Seconds between full rewrites of the mirrored sheets from SQLite; everything in between
+# is written incrementally
+SHEETS_RECONCILE_INTERVAL = 6 * 3600
+_RECONCILED_SHEETS = (
+    ('Patients', f'SELECT {_PATIENT_SHEET_COLUMNS} FROM patients ORDER BY id'),
+    ('Scan Activities', 'SELECT id, patient_uuid, timestamp FROM scan_activities ORDER BY id'),
+)
+
+# Rows sent per spreadsheets.batchUpdate call when a sheet is rewritten in full, keeping
+# each request's cell payload (and its memory) bounded however large the table grows
+SHEET_REWRITE_CHUNK_ROWS = 1000
+
+# Serializes incremental Sheets writes against a full rewrite of the same sheets
+_SHEET_WRITE_LOCK = threading.RLock()
+
+# Serializes writes on the shared SQLite connection across Streamlit sessions
+_DB_LOCK = threading.RLock()
+
+# Background worker thread per queue, so the exit flushes can stop it; the marker put on a
+# queue to make its worker hand over the batch it is still collecting; and how long exit
+# waits for that
+_WORKERS = {}
+_STOP_WORKER = object()
+WORKER_STOP_TIMEOUT = 10.0
+
+# Log events waiting for the background worker, written and shipped in batches of up to
+# LOG_SYNC_BATCH_SIZE rows or every LOG_SYNC_INTERVAL seconds
+LOG_SYNC_BATCH_SIZE = 50
+LOG_SYNC_INTERVAL = 5.0
+_log_queue = queue.Queue()
+
+# Most log rows shipped to Sheets per sync; anything beyond goes out with the next one
+LOG_SYNC_MAX_ROWS = 1000
+_LOG_SYNC_LOCK = threading.Lock()
+
+# Patient rows waiting for the background Sheets sync, coalesced per patient and written
+# in batches of up to PATIENT_SYNC_BATCH_SIZE rows or every PATIENT_SYNC_INTERVAL seconds
+PATIENT_SYNC_BATCH_SIZE = 50
+PATIENT_SYNC_INTERVAL = 2.0
+_patient_sync_queue = queue.Queue()
+
+# Each queued patient row carries a sequence number, and the newest one per patient is
+# remembered, so a row requeued after a failed batch is dropped once a newer row exists
+_patient_sync_seq = itertools.count()
+_patient_sync_latest = {}
+_PATIENT_SYNC_LOCK = threading.Lock()
+
+# Scan activities waiting for the background writer, flushed in batches of up to
+# SCAN_FLUSH_SIZE scans or every SCAN_FLUSH_INTERVAL seconds
+SCAN_FLUSH_SIZE = 20
+SCAN_FLUSH_INTERVAL = 1.0
+_scan_queue = queue.Queue()
 
 
-SHEET_ID = st.secrets.google_sheet_credentials.SHEET_ID
+# --------------------------
+# Shared Database Connection
+# --------------------------
+
+
+@st.cache_resource(show_spinner=False)
+def get_conn():
+    """
+    Returns the process-wide SQLite connection, opened once and reused by every session.
+    The connection runs in autocommit mode; writes must hold _DB_LOCK. Rows come back as
+    sqlite3.Row, so copy them with list(row) before handing them to gspread.
+
+    WAL lets readers proceed while a write commits and, with synchronous=NORMAL, avoids a
+    full fsync per commit. journal_mode persists in the database file; the other pragmas are
+    per-connection, which is why they are applied here rather than in init_db.
+    """
+    conn = sqlite3.connect('patients.db', check_same_thread=False, isolation_level=None)
+    try:
+        conn.executescript('''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA busy_timeout=30000;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-20000;
+            PRAGMA mmap_size=134217728;
+        ''')
+    except sqlite3.Error:
+        # Failures are not cached, so the next call opens a fresh connection; don't leak this one
+        conn.close()
+        raise
+    # Rows index by position and by column name, without a pandas round-trip
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+@contextmanager
+def transaction():
+    """
+    Runs the enclosed statements on the shared connection as a single
+    BEGIN IMMEDIATE ... COMMIT block (one fsync), rolling back on any error.
+
+    :yield: The shared SQLite connection.
+    """
+    conn = get_conn()
+    with _DB_LOCK:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
 
 
 # --------------------------
@@ -19,55 +213,102 @@ SHEET_ID = st.secrets.google_sheet_credentials.SHEET_ID
 # --------------------------
 
 
+@st.cache_resource(show_spinner=False)
 def init_db():
     try:
-        conn = sqlite3.connect('patients.db')
-        c = conn.cursor()
-
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS patients (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                uuid TEXT UNIQUE,
-                name TEXT,
-                age INTEGER,
-                nin TEXT UNIQUE,
-                phone TEXT UNIQUE,
-                emergency_contact TEXT,
-                genotype TEXT,
-                blood_type TEXT,
-                allergies TEXT,
-                medical_history TEXT,
-                patient_id TEXT UNIQUE,
-                qr_link TEXT
-            )
-        ''')
+        # Schema creation and the column migration commit together, or not at all
+        with transaction() as conn:
+            c = conn.cursor()
 
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS scan_activities (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                patient_uuid TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (patient_uuid) REFERENCES patients(uuid)
-            )
-        ''')
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS patients (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    uuid TEXT UNIQUE,
+                    name TEXT,
+                    age INTEGER,
+                    nin TEXT UNIQUE,
+                    phone TEXT UNIQUE,
+                    emergency_contact TEXT,
+                    genotype TEXT,
+                    blood_type TEXT,
+                    allergies TEXT,
+                    medical_history TEXT,
+                    patient_id TEXT UNIQUE,
+                    qr_link TEXT,
+                    allergies_md TEXT,
+                    medical_history_md TEXT
+                )
+            ''')
+            # nin, phone, uuid and patient_id need no extra indexes: their UNIQUE constraints
+            # already back every lookup with an automatic index
+
+            # Add the pre-rendered markdown columns to databases created before them,
+            # rendering the existing rows once so the scan view never has to
+            c.execute('PRAGMA table_info(patients)')
+            patient_columns = {column[1] for column in c.fetchall()}
+            for md_column, source_column in (('allergies_md', 'allergies'), ('medical_history_md', 'medical_history')):
+                if md_column not in patient_columns:
+                    c.execute(f'ALTER TABLE patients ADD COLUMN {md_column} TEXT')
+                    c.execute(f'SELECT id, {source_column} FROM patients')
+                    c.executemany(f'UPDATE patients SET {md_column} = ? WHERE id = ?',
+                                  [(format_bullet_list(text), row_id) for row_id, text in c.fetchall()])
 
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                level TEXT,
-                message TEXT
-            )
-        ''')
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS scan_activities (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    patient_uuid TEXT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (patient_uuid) REFERENCES patients(uuid)
+                )
+            ''')
+
+            c.execute('CREATE INDEX IF NOT EXISTS idx_scan_uuid ON scan_activities(patient_uuid)')
+
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS logs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    level TEXT,
+                    message TEXT
+                )
+            ''')
+
+            c.execute('CREATE INDEX IF NOT EXISTS idx_logs_timestamp ON logs(timestamp)')
+
+            # One (uuid, value) row per allergy / medical history entry, split from the stored
+            # comma-separated lists, so entries can be queried without parsing them in Python
+            for view, column in (('patient_allergies', 'allergies'), ('patient_medical_history', 'medical_history')):
+                c.execute(f'''
+                    CREATE VIEW IF NOT EXISTS {view} AS
+                    WITH RECURSIVE split(uuid, value, rest) AS (
+                        SELECT uuid, '', {column} || ',' FROM patients WHERE {column} != ''
+                        UNION ALL
+                        SELECT uuid, TRIM(substr(rest, 1, instr(rest, ',') - 1)), substr(rest, instr(rest, ',') + 1)
+                        FROM split WHERE rest != ''
+                    )
+                    SELECT uuid, value FROM split WHERE value != ''
+                ''')
+
+            # High-water marks for incremental Sheets syncs; a new mark starts at the rows
+            # that are already in the sheet
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    name TEXT PRIMARY KEY,
+                    last_id INTEGER NOT NULL
+                )
+            ''')
+            c.execute('''
+                INSERT OR IGNORE INTO sync_state (name, last_id)
+                SELECT 'logs', COALESCE(MAX(id), 0) FROM logs
+            ''')
 
-        conn.commit()
         #st.success("Database initialized successfully.")
 
     except sqlite3.Error as e:
         log_event("ERROR", f"An error occurred during database initialization: {e}")
-    finally:
-        if conn:
-            conn.close()
+        # Re-raised so st.cache_resource keeps nothing and the next rerun retries, rather
+        # than caching the failure for the life of the process
+        raise
 
 
 # --------------------------
@@ -76,37 +317,158 @@ def init_db():
 
 
 def log_event(level: str, message: str):
+    """
+    Queues the event for the background log worker, which writes queued events to the
+    'logs' table in batches and ships them to the 'Logs' sheet, so logging never waits
+    on a database commit or a Google Sheets round-trip.
+    """
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    _start_log_sync()
+    _log_queue.put((timestamp, level, message))
+
+
+@st.cache_resource(show_spinner=False)
+def _start_log_sync():
+    """
+    Starts the daemon thread that ships queued log rows to the 'Logs' sheet, once per process.
+    """
+    worker = threading.Thread(target=_log_sync_worker, name='log-sheets-sync', daemon=True)
+    worker.start()
+    _WORKERS[_log_queue] = worker
+    return worker
+
+
+def _log_sync_worker():
+    _run_batches(_log_queue, LOG_SYNC_BATCH_SIZE, LOG_SYNC_INTERVAL, _sync_log_batch)
+
+
+def _sync_log_batch(events):
+    if _write_log_batch(events):
+        _append_logs_to_sheet()
+
+
+def _write_log_batch(events):
+    """
+    Writes queued (timestamp, level, message) events to the 'logs' table with one prepared
+    INSERT in one transaction.
+
+    :return: True if the batch was written.
+    """
     try:
-        conn = sqlite3.connect('patients.db')
-        c = conn.cursor()
+        with transaction() as conn:
+            conn.executemany(_LOG_INSERT_SQL, events)
+    except sqlite3.Error:
+        # Off the script thread there is nowhere to report this
+        return False
+    return True
 
-        c.execute('''
-            INSERT INTO logs (level, message) 
-            VALUES (?, ?)
-        ''', (level, message))
 
-        conn.commit()
-    except sqlite3.Error as e:
-        st.error(f"Failed to log event to the database: {e}")
-    finally:
-        if conn:
-            conn.close()
+def _collect_batch(source, batch_size, interval):
+    """
+    Blocks until an item is queued on source, then keeps collecting until batch_size items
+    are gathered, interval seconds have passed or _STOP_WORKER is received.
+    """
+    items = [source.get()]
+    deadline = time.monotonic() + interval
+    while len(items) < batch_size and items[-1] is not _STOP_WORKER:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            items.append(source.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return items
 
+
+def _collect_log_batch():
+    return _collect_batch(_log_queue, LOG_SYNC_BATCH_SIZE, LOG_SYNC_INTERVAL)
+
+
+def _run_batches(source, batch_size, interval, handle):
+    """
+    Worker loop that passes each batch collected from source to handle. On _STOP_WORKER the
+    batch collected so far is handled and the loop returns.
+    """
+    while True:
+        items = _collect_batch(source, batch_size, interval)
+        stopping = items[-1] is _STOP_WORKER
+        if stopping:
+            items.pop()
+        if items:
+            handle(items)
+        if stopping:
+            return
+
+
+def _stop_worker(source):
+    """
+    Asks the worker draining source to finish the batch it holds and waits for it, so the
+    items it has already taken off the queue are not lost when the process exits.
+    """
+    worker = _WORKERS.pop(source, None)
+    if worker is not None and worker.is_alive():
+        source.put(_STOP_WORKER)
+        worker.join(WORKER_STOP_TIMEOUT)
+
+
+def _drain(source):
+    items = []
+    while not source.empty():
+        item = source.get_nowait()
+        if item is not _STOP_WORKER:
+            items.append(item)
+    return items
+
+
+def _append_logs_to_sheet():
+    # Runs off the script thread, where st.error has nowhere to render; failures are
+    # recorded in the 'logs' table instead, and the unsent rows go out with the next sync
+    if not sheets_available():
+        return
     try:
-        logs_worksheet = connect_to_google_sheet(SHEET_ID, 'Logs')
-        fetch_and_update_logs(logs_worksheet)
+        fetch_and_update_logs(_open_worksheet(_sheet_id(), 'Logs'))
     except Exception as e:
-        st.error(f"Failed to log event to Google Sheets: {e}")
+        _record_sheets_failure(e)
+        try:
+            with _DB_LOCK:
+                get_conn().execute(
+                    'INSERT INTO logs (level, message) VALUES (?, ?)',
+                    ("ERROR", f"Failed to sync log entries to Google Sheets: {e}"))
+        except sqlite3.Error:
+            pass
+
+
+def _flush_logs_at_exit():
+    _stop_worker(_log_queue)
+    events = _drain(_log_queue)
+    if events:
+        _sync_log_batch(events)
+
+
+atexit.register(_flush_logs_at_exit)
 
 
 def fetch_and_update_logs(worksheet):
-    query = "SELECT * FROM logs"
-    logs_df = fetch_db_data(query)
+    """
+    Appends the log rows written since the last sync to the worksheet and advances the
+    high-water mark kept in 'sync_state', so each sync ships only new rows. Rows a failed
+    sync did not ship stay above the mark and go out with the next call.
 
-    if logs_df is not None and not logs_df.empty:
-        sheet_data = [logs_df.columns.values.tolist()] + logs_df.values.tolist()
-        worksheet.clear()
-        worksheet.update('A1', sheet_data)
+    :param worksheet: The 'Logs' worksheet object from gspread.
+    """
+    with _LOG_SYNC_LOCK:
+        conn = get_conn()
+        mark = conn.execute("SELECT last_id FROM sync_state WHERE name = 'logs'").fetchone()
+        rows = conn.execute(_LOG_ROWS_AFTER_SQL, (mark[0] if mark else 0, LOG_SYNC_MAX_ROWS)).fetchall()
+        if not rows:
+            return
+
+        worksheet.append_rows([["" if v is None else v for v in row] for row in rows],
+                              value_input_option='RAW')
+        with _DB_LOCK:
+            conn.execute("INSERT OR REPLACE INTO sync_state (name, last_id) VALUES ('logs', ?)",
+                         (rows[-1][0],))
 
 
 # --------------------------
@@ -114,13 +476,58 @@ def fetch_and_update_logs(worksheet):
 # --------------------------
 
 
+def sheets_available():
+    """
+    Returns False while the Sheets circuit breaker is open after a recent outage.
+    """
+    return time.monotonic() >= _sheets_down_until
+
+
+def _record_sheets_failure(error):
+    """
+    Opens the Sheets circuit breaker for SHEETS_COOLDOWN seconds if the error looks like an outage.
+
+    :param error: The exception raised by a Sheets call.
+    """
+    global _sheets_down_until
+    if isinstance(error, _SHEETS_OUTAGE_ERRORS) and not isinstance(error, FileNotFoundError):
+        _sheets_down_until = time.monotonic() + SHEETS_COOLDOWN
+
+
+@st.cache_resource(show_spinner=False)
+def _gspread_client():
+    """
+    Load the service account credentials and authorize a gspread client, shared by every
+    session for the life of the process. gspread wraps the credentials in a google-auth
+    session that refreshes the access token when it expires, so the key file is read and
+    the client built only once.
+    """
+    scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+    creds = ServiceAccountCredentials.from_json_keyfile_name('mainCredentials.json', scope)
+    return gspread.authorize(creds)
+
+
+@st.cache_resource(ttl=SHEETS_HANDLE_TTL, show_spinner=False)
+def _open_spreadsheet(sheet_id):
+    return _gspread_client().open_by_key(sheet_id)
+
+
+@st.cache_resource(ttl=SHEETS_HANDLE_TTL, show_spinner=False)
+def _open_worksheet(sheet_id, sheet_name):
+    return _open_spreadsheet(sheet_id).worksheet(sheet_name)
+
+
 def connect_to_google_sheet(sheet_id, sheet_name):
+    """
+    Return the worksheet handle, reusing the cached client and spreadsheet across reruns.
+    Failures are reported and not cached, so the next rerun retries the connection.
+    """
+    if not sheets_available():
+        st.error("Google Sheets is temporarily unreachable; retrying shortly.")
+        return None
+
     try:
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        creds = ServiceAccountCredentials.from_json_keyfile_name('mainCredentials.json', scope)
-        client = gspread.authorize(creds)
-        sheet = client.open_by_key(sheet_id)
-        worksheet = sheet.worksheet(sheet_name)
+        worksheet = _open_worksheet(sheet_id, sheet_name)
         #st.success(f"Successfully connected to the Google Sheet: {sheet_name}")
         return worksheet
     except FileNotFoundError:
@@ -133,10 +540,21 @@ def connect_to_google_sheet(sheet_id, sheet_name):
         st.error(f"Worksheet named {sheet_name} not found in the Google Sheet.")
         return None
     except Exception as e:
+        _record_sheets_failure(e)
         st.error(f"An error occurred while connecting to the Google Sheet: {e}")
         return None
 
 
+def get_worksheets():
+    """
+    Return the 'Patients' and 'Scan Activities' worksheets, sharing one authorized client.
+    """
+    patient_worksheet = connect_to_google_sheet(_sheet_id(), 'Patients')
+    scan_worksheet = connect_to_google_sheet(_sheet_id(), 'Scan Activities')
+    _start_sheets_reconcile()
+    return patient_worksheet, scan_worksheet
+
+
 # --------------------------
 # Update Google Sheet
 # --------------------------
@@ -144,62 +562,392 @@ def connect_to_google_sheet(sheet_id, sheet_name):
 def update_google_sheet_from_db(worksheet, query):
     """
     Fetches data from SQLite and updates the Google Sheet.
+    Skips the upload when the data is unchanged since this session last pushed it.
     Handles errors using try-except blocks to ensure robustness.
 
     :param worksheet: The worksheet object from gspread.
     :param query: SQL query to fetch data.
     """
+    if not sheets_available():
+        st.error("Google Sheets is temporarily unreachable; skipping the sync.")
+        return
+
     try:
-        # Fetch data from the SQLite DB using the fetch_db_data function
-        df = fetch_db_data(query)
+        # Fetch the column names and raw rows straight from the SQLite cursor
+        result = fetch_db_rows(query)
 
-        # Check if DataFrame is valid
-        if df is None or df.empty:
+        # Check if any data was returned
+        if result is None or not result[1]:
             st.error("No data available to update the Google Sheet.")
             return
 
-        # Convert DataFrame to a list of lists (for Google Sheets API)
-        sheet_data = [df.columns.values.tolist()] + df.values.tolist()
+        # Convert to a list of lists (for Google Sheets API), blanking missing values
+        sheet_data = _sheet_values(*result)
 
-        # Clear existing data in the sheet
-        worksheet.clear()
+        # Skip the round-trip when the table is identical to the last upload
+        digest_key = f"sheet_digest:{worksheet.id}:{query}"
+        digest = hashlib.sha1(repr(sheet_data).encode()).hexdigest()
+        if st.session_state.get(digest_key) == digest:
+            return
 
-        # Update the Google Sheet with the new data
-        worksheet.update('A1', sheet_data)
+        _rewrite_sheet(worksheet, sheet_data)
+        st.session_state[digest_key] = digest
         st.success("Google Sheet updated successfully with new data.")
 
     except gspread.exceptions.APIError as e:
         # Handle specific Google Sheets API errors
+        _record_sheets_failure(e)
         st.error(f"Google Sheets API error: {e}")
         return
 
     except Exception as e:
         # Handle any other unforeseen exceptions
+        _record_sheets_failure(e)
         st.error(
             f"An unexpected error occurred while updating the Google Sheet: {e}")
         return
 
 
+def _cell_data(value):
+    # Typed values are stored as-is, like value_input_option='RAW'; blanks clear the cell
+    if value is None or value == "":
+        return {}
+    if isinstance(value, bool):
+        return {'userEnteredValue': {'boolValue': value}}
+    if isinstance(value, (int, float)):
+        return {'userEnteredValue': {'numberValue': value}}
+    return {'userEnteredValue': {'stringValue': str(value)}}
+
+
+def _sheet_rewrite_requests(worksheet, sheet_data):
+    """
+    Yields the spreadsheets.batchUpdate request lists that replace every value in the
+    worksheet with sheet_data, one list per SHEET_REWRITE_CHUNK_ROWS rows, so only one
+    chunk's cells are built at a time. Each updateCells range spans the full width and the
+    last one is open-ended, so cells outside sheet_data are cleared by the same requests
+    and no separate clear call is needed.
+
+    :param worksheet: The worksheet object from gspread.
+    :param sheet_data: The rows to write, header first; None and "" leave the cell blank.
+    :return: A generator of batchUpdate request lists.
+    """
+    requests = []
+    row_count = len(sheet_data)
+    col_count = max((len(row) for row in sheet_data), default=0)
+    if row_count > worksheet.row_count or col_count > worksheet.col_count:
+        # updateCells does not grow the grid, so make room first
+        requests.append({'updateSheetProperties': {
+            'properties': {'sheetId': worksheet.id, 'gridProperties': {
+                'rowCount': max(row_count, worksheet.row_count),
+                'columnCount': max(col_count, worksheet.col_count)}},
+            'fields': 'gridProperties(rowCount,columnCount)'}})
+
+    for start in range(0, max(row_count, 1), SHEET_REWRITE_CHUNK_ROWS):
+        end = start + SHEET_REWRITE_CHUNK_ROWS
+        cell_range = {'sheetId': worksheet.id, 'startRowIndex': start}
+        if end < row_count:
+            cell_range['endRowIndex'] = end
+        requests.append({'updateCells': {
+            'range': cell_range,
+            'rows': [{'values': [_cell_data(value) for value in row]} for row in sheet_data[start:end]],
+            'fields': 'userEnteredValue'}})
+        yield requests
+        requests = []
+
+
+def _rewrite_sheet(worksheet, sheet_data):
+    # Held against the incremental writers so no append lands in the middle of the rewrite
+    with _SHEET_WRITE_LOCK:
+        # One batchUpdate round-trip per chunk replaces the clear() + update() pair; a table
+        # within one chunk is rewritten in a single request
+        for requests in _sheet_rewrite_requests(worksheet, sheet_data):
+            worksheet.spreadsheet.batch_update({'requests': requests})
+
+        # Rows may have moved, so forget cached row numbers
+        sheet_rows = _patient_sheet_rows()
+        for key in [key for key in sheet_rows if key[0] == worksheet.id]:
+            del sheet_rows[key]
+
+
+def reconcile_google_sheets():
+    """
+    Rewrites the 'Patients' and 'Scan Activities' sheets in full from SQLite, repairing any
+    drift left by incremental writes that failed. Runs off the script thread, so failures
+    are logged rather than shown.
+    """
+    for sheet_name, query in _RECONCILED_SHEETS:
+        if not sheets_available():
+            return
+        try:
+            # Held from the snapshot to the end of the rewrite, so a scan or patient row
+            # appended in between is not overwritten by the older snapshot
+            with _SHEET_WRITE_LOCK:
+                result = fetch_db_rows(query)
+                if result is None:
+                    continue
+                columns, rows = result
+                # The cells are built straight from the SQLite rows; _cell_data blanks NULLs itself
+                _rewrite_sheet(_open_worksheet(_sheet_id(), sheet_name), [columns, *rows])
+        except Exception as e:
+            _record_sheets_failure(e)
+            log_event("ERROR", f"Failed to reconcile the '{sheet_name}' sheet: {e}")
+        else:
+            log_event("INFO", f"Reconciled the '{sheet_name}' sheet with {len(rows)} rows.")
+
+
+@st.cache_resource(show_spinner=False)
+def _start_sheets_reconcile():
+    """
+    Starts the daemon thread that reconciles the sheets every SHEETS_RECONCILE_INTERVAL
+    seconds, once per process.
+    """
+    worker = threading.Thread(target=_sheets_reconcile_worker, name='sheets-reconcile', daemon=True)
+    worker.start()
+    return worker
+
+
+def _sheets_reconcile_worker():
+    while True:
+        time.sleep(SHEETS_RECONCILE_INTERVAL)
+        reconcile_google_sheets()
+
+
 # --------------------------
 # Fetch Data from SQLite
 # --------------------------
 
 
-def fetch_db_data(query):
+def fetch_db_data(query, conn=None, as_dataframe=True):
+    """
+    Runs the query and returns the result as a DataFrame, built straight from the cursor's
+    rows. Sheets syncs should use fetch_db_rows, which skips the DataFrame entirely.
+
+    :param query: SQL query to fetch data.
+    :param conn: An open connection to read through (e.g. inside a transaction); defaults to the shared one.
+    :param as_dataframe: When False, return the raw (column names, rows) pair without loading pandas.
+    """
+    result = fetch_db_rows(query, conn)
+    if result is None or not as_dataframe:
+        return result
+
     try:
-        conn = sqlite3.connect('patients.db')
-        df = pd.read_sql_query(query, conn)
+        # Imported here so the app and the Sheets syncs, which never build a DataFrame,
+        # don't pay for loading pandas
+        import pandas as pd
+
+        columns, rows = result
+        df = pd.DataFrame.from_records(rows, columns=columns)
         st.success("Data fetched successfully from the database.")
         return df
+    except Exception as e:
+        st.error(f"An unexpected error occurred: {e}")
+        return None
+
+
+def fetch_db_rows(query, conn=None):
+    """
+    Runs the query and returns its column names and raw rows, without building a DataFrame.
+    Results read through the shared connection are reused until the database changes.
+
+    :param query: SQL query to fetch data.
+    :param conn: An open connection to read through (e.g. inside a transaction); defaults to the shared one.
+    :return: A (columns, rows) tuple, or None if the query failed.
+    """
+    try:
+        if conn is not None:
+            return _query_rows(conn, query)
+
+        # Reuse the last result for this query until a write lands on this connection or,
+        # via data_version, from another one. The lock keeps the read out of another thread's
+        # open transaction, whose rows a rollback would leave cached: total_changes does not
+        # go back down
+        conn = get_conn()
+        with _DB_LOCK:
+            version = (conn.total_changes, conn.execute("PRAGMA data_version").fetchone()[0])
+            cache = _db_rows_cache()
+            cached = cache.get(query)
+            if cached is not None and cached[0] == version:
+                return cached[1]
+
+            result = _query_rows(conn, query)
+            if len(cache) >= DB_ROWS_CACHE_SIZE:
+                cache.clear()
+            cache[query] = (version, result)
+            return result
     except sqlite3.Error as e:
         st.error(f"An error occurred while fetching data from the database: {e}")
         return None
-    except Exception as e:
-        st.error(f"An unexpected error occurred: {e}")
+
+
+def _query_rows(conn, query):
+    cur = conn.execute(query)
+    return [d[0] for d in cur.description], cur.fetchall()
+
+
+@st.cache_resource(show_spinner=False)
+def _db_rows_cache():
+    """
+    Returns the process-wide map of query to (database version, (columns, rows)) used by
+    fetch_db_rows on the shared connection.
+    """
+    return {}
+
+
+def _sheet_values(columns, rows):
+    return [list(columns)] + [["" if v is None else v for v in row] for row in rows]
+
+
+# --------------------------
+# Append-only Google Sheet Writes
+# --------------------------
+
+
+@st.cache_resource(show_spinner=False)
+def _patient_sheet_rows():
+    """
+    Returns the process-wide map of (worksheet id, patient UUID) to the patient's row number
+    in the 'Patients' sheet, so repeat updates skip looking the patient up in the sheet.
+    """
+    return {}
+
+
+def _appended_row_number(response):
+    """
+    Reads the row number of the first appended row from the Sheets API append response.
+
+    :param response: The response returned by worksheet.append_rows.
+    :return: The 1-based number of the first appended row, or None if the response does not include it.
+    """
+    try:
+        updated_range = response['updates']['updatedRange']
+        return gspread.utils.a1_to_rowcol(updated_range.split('!')[-1].split(':')[0])[0]
+    except (KeyError, TypeError, IndexError, gspread.exceptions.IncorrectCellLabel):
         return None
-    finally:
-        if conn:
-            conn.close()
+
+
+def sync_patient_rows_to_sheet(worksheet, rows):
+    """
+    Mirrors patient rows to the worksheet: rows already in the sheet are rewritten in place
+    with one batch_update, new ones are appended with one append_rows. Row numbers come
+    from the cached row map; any misses are resolved with a single read of the UUID column.
+
+    :param worksheet: The worksheet object from gspread.
+    :param rows: Full patient records as mirrored to the 'Patients' sheet.
+    """
+    with _SHEET_WRITE_LOCK:
+        _sync_patient_rows(worksheet, rows)
+
+
+def _sync_patient_rows(worksheet, rows):
+    sheet_rows = _patient_sheet_rows()
+    if any((worksheet.id, row[1]) not in sheet_rows for row in rows):
+        for row_number, patient_uuid in enumerate(worksheet.col_values(2), start=1):
+            if patient_uuid:
+                sheet_rows[(worksheet.id, patient_uuid)] = row_number
+
+    updates, new_rows = [], []
+    for row in rows:
+        row_number = sheet_rows.get((worksheet.id, row[1]))
+        if row_number is None:
+            new_rows.append(row)
+            continue
+        start = gspread.utils.rowcol_to_a1(row_number, 1)
+        end = gspread.utils.rowcol_to_a1(row_number, len(row))
+        updates.append({'range': f"{start}:{end}", 'values': [list(row)]})
+
+    if updates:
+        worksheet.batch_update(updates, value_input_option='RAW')
+    if new_rows:
+        response = worksheet.append_rows([list(row) for row in new_rows], value_input_option='RAW')
+        first_row = _appended_row_number(response)
+        if first_row is not None:
+            for offset, row in enumerate(new_rows):
+                sheet_rows[(worksheet.id, row[1])] = first_row + offset
+
+
+def upsert_patient_row_in_sheet(worksheet, row):
+    """
+    Updates the patient's existing row in the worksheet in place, or appends it when the
+    patient is not in the sheet yet.
+
+    :param worksheet: The worksheet object from gspread.
+    :param row: The full patient record as mirrored to the 'Patients' sheet.
+    """
+    sync_patient_rows_to_sheet(worksheet, [row])
+
+
+def queue_patient_sheet_sync(worksheet, row):
+    """
+    Hands the patient row to the background patient sync, which coalesces queued rows and
+    writes them to the worksheet in batches, off the request path.
+
+    :param worksheet: The 'Patients' worksheet object from gspread.
+    :param row: The full patient record as mirrored to the 'Patients' sheet.
+    """
+    if worksheet is None:
+        # The worksheet could not be opened; the error was already reported on connect
+        return
+    _start_patient_sync()
+    with _PATIENT_SYNC_LOCK:
+        seq = next(_patient_sync_seq)
+        _patient_sync_latest[(worksheet.id, row[1])] = seq
+        _patient_sync_queue.put((worksheet, row, seq))
+
+
+@st.cache_resource(show_spinner=False)
+def _start_patient_sync():
+    """
+    Starts the daemon thread that ships queued patient rows to Sheets, once per process.
+    """
+    worker = threading.Thread(target=_patient_sync_worker, name='patient-sheets-sync', daemon=True)
+    worker.start()
+    _WORKERS[_patient_sync_queue] = worker
+    return worker
+
+
+def _patient_sync_worker():
+    _run_batches(_patient_sync_queue, PATIENT_SYNC_BATCH_SIZE, PATIENT_SYNC_INTERVAL,
+                 _sync_patient_batch_after_cooldown)
+
+
+def _sync_patient_batch_after_cooldown(items):
+    # Wait out an open circuit breaker rather than failing the batch
+    time.sleep(max(0.0, _sheets_down_until - time.monotonic()))
+    _sync_patient_batch(items)
+
+
+def _sync_patient_batch(items):
+    # Only the newest queued row per patient is sent, whatever order requeues left the batch
+    # in, and each worksheet gets one sync call
+    by_worksheet = {}
+    for worksheet, row, seq in items:
+        if seq == _patient_sync_latest.get((worksheet.id, row[1])):
+            by_worksheet.setdefault(worksheet.id, (worksheet, {}))[1][row[1]] = (row, seq)
+
+    for worksheet, pending in by_worksheet.values():
+        rows = [row for row, _ in pending.values()]
+        try:
+            sync_patient_rows_to_sheet(worksheet, rows)
+        except Exception as e:
+            # Off the script thread there is nowhere to render st.error
+            log_event("ERROR", f"Error updating Google Sheet with {len(rows)} patient row(s): {e}")
+            _record_sheets_failure(e)
+            if not sheets_available():
+                # An outage: keep the rows for the batch after the cooldown
+                for row, seq in pending.values():
+                    _patient_sync_queue.put((worksheet, row, seq))
+        else:
+            log_event("INFO", f"Google Sheet updated with {len(rows)} patient row(s).")
+
+
+def _flush_patient_sync_at_exit():
+    _stop_worker(_patient_sync_queue)
+    items = _drain(_patient_sync_queue)
+    if items and sheets_available():
+        _sync_patient_batch(items)
+
+
+atexit.register(_flush_patient_sync_at_exit)
 
 
 # --------------------------
@@ -208,54 +956,89 @@ def fetch_db_data(query):
 
 def log_scan_activity(patient_uuid, scan_worksheet):
     """
-    Log the scan activity in the 'scan_activities' table without storing the IP address.
-    After logging, sync the scan activities with Google Sheets.
-    Handles errors using try-except blocks to ensure robustness.
+    Log the scan activity without storing the IP address. Scans are queued for a background
+    writer that stores them in the 'scan_activities' table and Google Sheets in batches, so
+    the scan view never waits on a commit or a Sheets round-trip, and a burst of scans costs
+    one transaction and one Sheets call rather than one per scan.
 
     :param patient_uuid: The UUID of the patient whose scan activity is being logged.
     :param scan_worksheet: The worksheet object from gspread for logging scan activities.
     """
-    try:
-        # Connect to the SQLite database
-        conn = sqlite3.connect('patients.db')
-        c = conn.cursor()
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    _start_scan_sync()
+    _scan_queue.put((scan_worksheet, (patient_uuid, timestamp)))
+    st.success("Scan activity logged successfully.")
+
+
+@st.cache_resource(show_spinner=False)
+def _start_scan_sync():
+    """
+    Starts the daemon thread that writes queued scan activities, once per process.
+    """
+    worker = threading.Thread(target=_scan_sync_worker, name='scan-activity-sync', daemon=True)
+    worker.start()
+    _WORKERS[_scan_queue] = worker
+    return worker
+
+
+def _scan_sync_worker():
+    _run_batches(_scan_queue, SCAN_FLUSH_SIZE, SCAN_FLUSH_INTERVAL, flush_scan_activities)
 
-        # Insert scan activity into the 'scan_activities' table
-        c.execute('''
-            INSERT INTO scan_activities (patient_uuid)
-            VALUES (?)
-        ''', (patient_uuid,))
 
-        # Commit the transaction
-        conn.commit()
+def flush_scan_activities(items):
+    """
+    Writes queued scan activities to SQLite with one executemany inside a single
+    transaction, then appends them to each worksheet with one append_rows call.
+    If the database write fails, the scans are queued again for the next flush; rows a
+    failed Sheets append misses are restored by the periodic reconcile.
+
+    :param items: List of (scan worksheet, (patient_uuid, timestamp)) tuples.
+    """
+    if not items:
+        return
+    rows = [row for _, row in items]
 
-        st.success("Scan activity logged successfully.")
+    try:
+        with transaction() as conn:
+            conn.executemany(_SCAN_INSERT_SQL, rows)
+            # Ids are consecutive because the write lock is held for the whole batch
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
 
     except sqlite3.Error as e:
-        # Handle SQLite database errors
-        st.error(f"An error occurred while logging scan activity: {e}")
+        # Off the script thread there is nowhere to render st.error; keep the scans
+        log_event("ERROR", f"An error occurred while logging {len(rows)} scan activities: {e}")
+        for item in items:
+            _scan_queue.put(item)
         return
 
-    except Exception as e:
-        # Handle any other unforeseen exceptions
-        st.error(f"An unexpected error occurred: {e}")
+    first_id = last_id - len(rows) + 1
+    by_worksheet = {}
+    for i, (worksheet, (patient_uuid, timestamp)) in enumerate(items):
+        if worksheet is not None:
+            # The worksheet could not be opened otherwise; the error was reported on connect
+            by_worksheet.setdefault(worksheet.id, (worksheet, []))[1].append(
+                [first_id + i, patient_uuid, timestamp])
+
+    if not sheets_available():
         return
 
-    finally:
-        # Ensure the database connection is closed
-        if conn:
-            conn.close()
+    # Append only the new scan activities to Google Sheets
+    for worksheet, sheet_rows in by_worksheet.values():
+        try:
+            with _SHEET_WRITE_LOCK:
+                worksheet.append_rows(sheet_rows, value_input_option='RAW')
+        except Exception as e:
+            # Handle errors while updating the Google Sheet
+            _record_sheets_failure(e)
+            log_event("ERROR", f"An error occurred while updating the Google Sheet with scan activities: {e}")
 
-    # Sync the updated scan activities with Google Sheets
-    try:
-        update_google_sheet_from_db(
-            scan_worksheet, "SELECT * FROM scan_activities")
-        st.success("Google Sheet updated with scan activities.")
 
-    except Exception as e:
-        # Handle errors while updating the Google Sheet
-        st.error(
-            f"An error occurred while updating the Google Sheet with scan activities: {e}")
+def _flush_scan_activities_at_exit():
+    _stop_worker(_scan_queue)
+    flush_scan_activities(_drain(_scan_queue))
+
+
+atexit.register(_flush_scan_activities_at_exit)
 
 
 # --------------------------
@@ -263,28 +1046,90 @@ def log_scan_activity(patient_uuid, scan_worksheet):
 # --------------------------
 
 
-def create_qr_code(data: str, file_path: str) -> BytesIO:
+@functools.lru_cache(maxsize=16)
+def _ensure_dir(directory):
+    # exist_ok avoids the exists/makedirs race; the cache makes repeat calls a dict lookup
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+# The PNG is immutable bytes, so a hit hands back the same object; st.cache_data would
+# unpickle a fresh copy on every hit (~100us against ~0.2us here)
+@functools.lru_cache(maxsize=512)
+def _qr_png_bytes(data: str, scale: int) -> bytes:
+    """
+    Encodes the QR code for the payload as PNG bytes, memoized so identical payloads skip re-encoding.
+    """
+    # A fixed mask skips scoring all eight mask patterns, the dominant encoding cost;
+    # boost_error=False keeps the requested 'h' level instead of searching for a higher one
+    qr_code = segno.make(data, error='h', mask=3, boost_error=False)
+    byte_stream = BytesIO()
+    qr_code.save(byte_stream, kind='png', scale=scale)
+    return byte_stream.getvalue()
+
+
+def _qr_file_path(file_path: str, data: str) -> str:
+    """
+    Inserts a short hash of the payload before the file extension, so a saved QR code is only
+    reused for the exact link it encodes (e.g. not after QR_LINK_TEMPLATE's host changes).
+    """
+    root, ext = os.path.splitext(file_path)
+    return f"{root}_{hashlib.blake2b(data.encode(), digest_size=4).hexdigest()}{ext}"
+
+
+def _write_file_atomically(file_path: str, content: bytes):
+    # Written to a temporary file in the same directory and renamed over the target, so a
+    # failed write never leaves a truncated PNG to be served later
+    directory = os.path.dirname(file_path)
+    _ensure_dir(directory)
+    temp_file = tempfile.NamedTemporaryFile(dir=directory or '.', suffix='.tmp', delete=False)
     try:
-        directory = os.path.dirname(file_path)
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-    except OSError as e:
-        st.error(f"An error occurred while creating the directory: {e}")
-        return None
+        with temp_file:
+            temp_file.write(content)
+        # NamedTemporaryFile creates the file owner-only; saved QR codes stay world-readable
+        os.chmod(temp_file.name, 0o644)
+        os.replace(temp_file.name, file_path)
+    except BaseException:
+        try:
+            os.remove(temp_file.name)
+        except OSError:
+            pass
+        raise
+
+
+def create_qr_code(data: str, file_path: str = None) -> BytesIO:
+    """
+    Returns the QR code PNG for the payload as a BytesIO. The PNG is encoded once; when
+    file_path is given the same bytes are also persisted next to it, under a name carrying a
+    hash of the payload, otherwise nothing touches disk. A file already saved for the same
+    payload is returned as-is without encoding, and a failed write is reported but still
+    returns the encoded PNG.
+    """
+    # The PNG is deterministic for a given payload and the file name carries its hash, so an
+    # existing file is already current
+    if file_path is not None:
+        file_path = _qr_file_path(file_path, data)
+        try:
+            with open(file_path, 'rb') as f:
+                return BytesIO(f.read())
+        except OSError:
+            pass
 
     try:
-        qr_code = segno.make(data, error='h')
-        qr_code.save(file_path, scale=10)
-        st.success(f"QR code saved successfully at {file_path}")
-
-        byte_stream = BytesIO()
-        qr_code.save(byte_stream, kind='png', scale=10)
-        byte_stream.seek(0)
-        return byte_stream
+        png = _qr_png_bytes(data, QR_SCALE)
     except Exception as e:
         st.error(f"An error occurred while creating the QR code: {e}")
         return None
 
+    if file_path is not None:
+        try:
+            _write_file_atomically(file_path, png)
+            st.success(f"QR code saved successfully at {file_path}")
+        except OSError as e:
+            st.error(f"An error occurred while saving the QR code: {e}")
+
+    return BytesIO(png)
+
 
 # --------------------------
 # Validate phone number and emergency contact to ensure both are not the same
@@ -299,29 +1144,40 @@ def validate_phone_and_emergency_contact(phone, emergency_contact):
 
 
 def validate_nin(nin_value):
-    return len(nin_value) == 11 and nin_value.isdigit()
+    """
+    Checks that the NIN is exactly 11 ASCII digits. The length test rejects most bad input
+    first; isascii() keeps str.isdigit() from accepting other scripts' digits.
+    """
+    return len(nin_value) == 11 and nin_value.isascii() and nin_value.isdigit()
 
 
-def validate_phone(phone_value):
-    phone_digits = re.sub(r'\D', '', phone_value)
-    if len(phone_digits) == 10:
-        return f"+234{phone_digits}"
-    if len(phone_digits) == 11 and phone_digits.startswith("0"):
-        return f"+234{phone_digits[1:]}"
-    if len(phone_digits) == 13 and phone_digits.startswith("234"):
-        return f"+{phone_digits}"
+def _normalize_ng_phone(value):
+    # Non-ASCII input is rejected outright rather than having its characters dropped, and
+    # '+' is only accepted as the leading international prefix
+    value = value.strip()
+    if not value.isascii():
+        return None
+    if value.startswith('+'):
+        value = value[1:]
+    digits = value.encode('ascii').translate(None, _PHONE_SEPARATORS)
+    if not digits.isdigit():
+        return None
+    digits = digits.decode('ascii')
+    if len(digits) == 10:
+        return f"+234{digits}"
+    if len(digits) == 11 and digits.startswith("0"):
+        return f"+234{digits[1:]}"
+    if len(digits) == 13 and digits.startswith("234"):
+        return f"+{digits}"
     return None
 
 
+def validate_phone(phone_value):
+    return _normalize_ng_phone(phone_value)
+
+
 def validate_emergency_contact(emergency_contact_value):
-    contact_digits = re.sub(r'\D', '', emergency_contact_value)
-    if len(contact_digits) == 10:
-        return f"+234{contact_digits}"
-    if len(contact_digits) == 11 and contact_digits.startswith("0"):
-        return f"+234{contact_digits[1:]}"
-    if len(contact_digits) == 13 and contact_digits.startswith("234"):
-        return f"+{contact_digits}"
-    return None
+    return _normalize_ng_phone(emergency_contact_value)
 
 
 # --------------------------
@@ -331,14 +1187,11 @@ def validate_emergency_contact(emergency_contact_value):
 
 def get_patient_by_id(patient_id):
     try:
-        conn = sqlite3.connect('patients.db')
-        c = conn.cursor()
-        c.execute('SELECT * FROM patients WHERE patient_id = ?', (patient_id,))
-        patient = c.fetchone()
+        patient = get_conn().execute(_PATIENT_VIEW_SQL, (patient_id,)).fetchone()
         if patient is None:
             st.warning(f"No patient found with patient ID: {patient_id}")
             return None
-        #st.success(f"Patient found: {patient[2]}")
+        #st.success(f"Patient found: {patient['name']}")
         return patient
     except sqlite3.Error as e:
         st.error(f"An error occurred while retrieving the patient data: {e}")
@@ -346,9 +1199,6 @@ def get_patient_by_id(patient_id):
     except Exception as e:
         st.error(f"An unexpected error occurred: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
 
 # --------------------------
@@ -356,42 +1206,48 @@ def get_patient_by_id(patient_id):
 # --------------------------
 
 
+def dedupe_and_clean(text):
+    """
+    Strips and dedupes a comma-separated field, keeping the order the entries were typed in.
+    """
+    if not text:
+        return ""
+    # A single entry, the common case, needs no split or dedupe
+    if ',' not in text:
+        return text.strip()
+    # dict.fromkeys dedupes in one pass and keeps insertion order; each entry is stripped once
+    return ','.join(dict.fromkeys(entry for entry in map(str.strip, text.split(',')) if entry))
+
+
 def insert_or_update_patient(name, age, nin, phone, emergency_contact, genotype, blood_type, new_allergies,
                              new_medical_history, patient_id, patient_worksheet, _scan_worksheet):
-    try:
-        conn = sqlite3.connect('patients.db')
-        c = conn.cursor()
+    qr_link = QR_LINK_TEMPLATE.format(patient_id=patient_id)
 
-        c.execute('SELECT uuid, qr_link FROM patients WHERE nin = ? OR phone = ?', (nin, phone))
-        existing_data = c.fetchone()
+    allergies_cleaned = dedupe_and_clean(new_allergies)
+    medical_history_cleaned = dedupe_and_clean(new_medical_history)
 
-        def dedupe_and_clean(text):
-            if text:
-                return ','.join(sorted(set([entry.strip() for entry in text.split(',') if entry.strip()])))
-            return ""
-
-        qr_link = f"https://frequently-beloved-robin.ngrok-free.app/?patient_id={patient_id}"
+    # Render the scan view's markdown once at write time
+    allergies_md = format_bullet_list(allergies_cleaned)
+    medical_history_md = format_bullet_list(medical_history_cleaned)
 
+    try:
+        # One UPSERT keyed on either unique identifier replaces the lookup, the UPDATE or
+        # INSERT and the read-back; RETURNING hands back the row to mirror to Sheets
+        new_uuid = uuid.uuid4().hex
+        with transaction() as conn:
+            patient_row = conn.execute(_PATIENT_UPSERT_SQL, (
+                new_uuid, name, age, nin, phone, emergency_contact, genotype, blood_type, allergies_cleaned,
+                medical_history_cleaned, patient_id, qr_link, allergies_md, medical_history_md)).fetchone()
+
+        # An updated row keeps its original uuid, so a fresh one means a new patient
+        existing_data = patient_row[1] != new_uuid
         if existing_data:
-            c.execute('''
-                UPDATE patients 
-                SET name = ?, age = ?, allergies = ?, medical_history = ?, emergency_contact = ?, genotype = ?, blood_type = ?, qr_link = ?
-                WHERE nin = ? OR phone = ?
-            ''', (name, age, new_allergies, new_medical_history, emergency_contact, genotype, blood_type, qr_link, nin, phone))
-            st.success(f"Patient with the phone number {phone} updated successfully.")
-            log_event("INFO", f"Patient with the phone number {phone} updated successfully.")
+            message = f"Patient with the phone number {phone} updated successfully."
         else:
-            patient_uuid = str(uuid.uuid4())
-            new_allergies_cleaned = dedupe_and_clean(new_allergies)
-            new_medical_history_cleaned = dedupe_and_clean(new_medical_history)
-            c.execute('''
-                INSERT INTO patients (uuid, name, age, nin, phone, emergency_contact, genotype, blood_type, allergies, medical_history, patient_id, qr_link)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (patient_uuid, name, age, nin, phone, emergency_contact, genotype, blood_type, new_allergies_cleaned, new_medical_history_cleaned, patient_id, qr_link))
-            st.success(f"New patient with the phone number {phone} added successfully.")
-            log_event("INFO", f"New patient with the phone number {phone} added successfully.")
+            message = f"New patient with the phone number {phone} added successfully."
 
-        conn.commit()
+        st.success(message)
+        log_event("INFO", message)
     except sqlite3.Error as e:
         st.error(f"An error occurred while inserting/updating the patient record: {e}")
         log_event("ERROR", f"SQLite error while inserting/updating patient: {e}")
@@ -400,24 +1256,123 @@ def insert_or_update_patient(name, age, nin, phone, emergency_contact, genotype,
         st.error(f"An unexpected error occurred: {e}")
         log_event("ERROR", f"Unexpected error: {e}")
         return None
-    finally:
-        if conn:
-            conn.close()
 
-    try:
-        update_google_sheet_from_db(patient_worksheet, "SELECT * FROM patients")
-        st.success("Google Sheet updated successfully with patient data.")
-        log_event("INFO", "Google Sheet updated with patient data.")
-    except Exception as e:
-        st.error(f"An error occurred while updating the Google Sheet: {e}")
-        log_event("ERROR", f"Error updating Google Sheet: {e}")
-        return None
+    # The sheet is updated in the background; the QR link does not wait on Google Sheets
+    queue_patient_sheet_sync(patient_worksheet, patient_row)
 
     return qr_link
 
 
+def bulk_insert_patients(patients, patient_worksheet=None):
+    """
+    Inserts many new patients in a single transaction with one prepared INSERT, instead of
+    one commit per patient. Existing patients are not looked up or updated here.
+
+    :param patients: Iterable of (name, age, nin, phone, emergency_contact, genotype,
+                     blood_type, allergies, medical_history, patient_id) tuples.
+    :param patient_worksheet: Optional worksheet to mirror the new rows to via the background sync.
+    :return: The number of patients inserted (0 on failure).
+    """
+    patients = list(patients)
+    # One urandom read supplies every UUID instead of one read per patient
+    raw = os.urandom(16 * len(patients))
+    rows = []
+    for i, (name, age, nin, phone, emergency_contact, genotype, blood_type, allergies, medical_history,
+            patient_id) in enumerate(patients):
+        allergies_cleaned = dedupe_and_clean(allergies)
+        medical_history_cleaned = dedupe_and_clean(medical_history)
+        patient_uuid = uuid.UUID(bytes=raw[16 * i:16 * i + 16], version=4).hex
+        rows.append((patient_uuid, name, age, nin, phone, emergency_contact, genotype, blood_type,
+                     allergies_cleaned, medical_history_cleaned, patient_id,
+                     QR_LINK_TEMPLATE.format(patient_id=patient_id),
+                     format_bullet_list(allergies_cleaned), format_bullet_list(medical_history_cleaned)))
+    if not rows:
+        return 0
+
+    try:
+        with transaction() as conn:
+            conn.executemany(_PATIENT_INSERT_SQL, rows)
+            last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+            sheet_rows = conn.execute(_PATIENT_ROWS_AFTER_SQL, (last_id - len(rows),)).fetchall()
+    except sqlite3.Error as e:
+        st.error(f"An error occurred while inserting the patient records: {e}")
+        log_event("ERROR", f"SQLite error while bulk inserting patients: {e}")
+        return 0
+
+    log_event("INFO", f"{len(rows)} patients added in bulk.")
+
+    if patient_worksheet is not None:
+        for row in sheet_rows:
+            queue_patient_sheet_sync(patient_worksheet, row)
+
+    return len(rows)
+
+
+def bulk_log_events(events):
+    """
+    Queues many events for the background log worker in one call; the worker writes each
+    drained batch with one prepared INSERT in a single transaction.
+
+    :param events: Iterable of (level, message) tuples.
+    """
+    timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    _start_log_sync()
+    for level, message in events:
+        _log_queue.put((timestamp, level, message))
+
+def format_bullet_list(text):
+    """
+    Renders a comma-separated field (allergies, medical history) as a markdown bullet list.
+    Blank entries are dropped; None renders as an empty string.
+    """
+    entries = [entry for entry in map(str.strip, (text or "").split(',')) if entry]
+    return "- " + "\n- ".join(entries) if entries else ""
+
+
+@st.cache_resource(show_spinner=False)
+def load_first_aid_image():
+    """
+    Reads the CPR illustration once per process; st.image serves the PNG bytes as-is.
+    """
+    return FIRST_AID_IMAGE_PATH.read_bytes()
+
+
+# Scrolls the first aid guide's container one step every FIRST_AID_SCROLL_SECONDS,
+# pausing while the reader hovers over or touches it so manual scrolling takes over
+_FIRST_AID_AUTO_SCROLL_JS = '''
+<script>
+(function () {
+    const doc = window.parent.document;
+    const marker = doc.getElementById('first-aid-guide');
+    let box = marker && marker.parentElement;
+    while (box && !(box.scrollHeight > box.clientHeight &&
+                    ['auto', 'scroll'].includes(getComputedStyle(box).overflowY))) {
+        box = box.parentElement;
+    }
+    // Readers who asked for reduced motion scroll the guide themselves
+    if (!box || box.dataset.autoScroll ||
+        window.parent.matchMedia('(prefers-reduced-motion: reduce)').matches) return;
+    box.dataset.autoScroll = 'on';
+
+    let paused = false;
+    box.addEventListener('mouseenter', () => { paused = true; });
+    box.addEventListener('mouseleave', () => { paused = false; });
+    box.addEventListener('touchstart', () => { paused = true; }, {passive: true});
+
+    const timer = setInterval(() => {
+        if (!box.isConnected) return clearInterval(timer);
+        if (paused) return;
+        if (box.scrollTop + box.clientHeight >= box.scrollHeight - 1) return clearInterval(timer);
+        box.scrollBy({top: box.clientHeight * 0.8, behavior: 'smooth'});
+    }, %d);
+})();
+</script>
+''' % (FIRST_AID_SCROLL_SECONDS * 1000)
+
+
 def display_first_aid_guide_auto_scroll_with_manual():
-    guide_container = st.container()
+    # A fixed height makes the container scroll instead of growing with the guide
+    guide_container = st.container(height=FIRST_AID_GUIDE_HEIGHT)
 
     guide_sections = [
         """
@@ -492,7 +1447,9 @@ def display_first_aid_guide_auto_scroll_with_manual():
         """
     ]
 
+    # Everything renders in one pass; the scrolling happens in the browser, so the script
+    # thread is never held while the reader works through the guide
     with guide_container:
-        for section in guide_sections:
-            st.markdown(section)
-            time.sleep(3)
+        st.markdown('<span id="first-aid-guide"></span>', unsafe_allow_html=True)
+        st.markdown("\n".join(guide_sections))
+    components.html(_FIRST_AID_AUTO_SCROLL_JS, height=0)
@@ -0,0 +1,9 @@
+import os
+import pathlib
+import sys
+
+# Make functions.py importable from the project root, however pytest is invoked
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+# Run streamlit as the container does, before any test module imports it
+os.environ.setdefault("STREAMLIT_SERVER_HEADLESS", "true")
@@ -1,165 +1,750 @@
 # Import the relevant functions from functions.py
+import functions
 from functions import (
-    init_db, log_event, connect_to_google_sheet, fetch_db_data, update_google_sheet_from_db,
-    log_scan_activity, create_qr_code, validate_phone_and_emergency_contact, validate_nin,
-    validate_phone, validate_emergency_contact, get_patient_by_id, insert_or_update_patient,
-    display_first_aid_guide_auto_scroll_with_manual
+    get_conn, init_db, log_event, fetch_and_update_logs, connect_to_google_sheet, _gspread_client, _open_spreadsheet, _open_worksheet, fetch_db_data, fetch_db_rows, update_google_sheet_from_db,
+    log_scan_activity, flush_scan_activities, upsert_patient_row_in_sheet, _patient_sheet_rows, create_qr_code, validate_phone_and_emergency_contact, validate_nin,
+    validate_phone, validate_emergency_contact, get_patient_by_id, insert_or_update_patient, bulk_insert_patients, bulk_log_events, dedupe_and_clean, format_bullet_list,
+    display_first_aid_guide_auto_scroll_with_manual, load_first_aid_image
 )
+from dataclasses import astuple, dataclass, replace
+import gspread
+import sqlite3
+import tempfile
+import threading
+import time
 import unittest
-from unittest.mock import patch, MagicMock
-import pandas as pd
+import uuid
+from unittest.mock import patch, MagicMock, ANY, DEFAULT
 from io import BytesIO
 import os
-import sys
 
-# Ensure the parent directory is in the system path for imports
-sys.path.insert(0, os.path.abspath(
-    os.path.join(os.path.dirname(__file__), '..')))
+@dataclass(frozen=True, slots=True)
+class PatientInput:
+    """ The form fields passed to insert_or_update_patient / bulk_insert_patients, in order. """
+    name: str = "John Doe"
+    age: int = 25
+    nin: str = "12345678901"
+    phone: str = "+2341234567890"
+    emergency_contact: str = "+2340987654321"
+    genotype: str = "AA"
+    blood_type: str = "O+"
+    allergies: str = "Peanuts"
+    medical_history: str = "Asthma"
+    patient_id: str = "PAT123"
+
+
+DEFAULT_PATIENT = PatientInput()
+
+
+# One in-memory database for the whole module; every test starts from its emptied tables
+_TEST_DB_URI = 'file:visionx_test?mode=memory&cache=shared'
+_test_db = None
+_get_conn_patcher = None
+
+# Sleeps on the test thread are recorded instead of waited out. time.sleep is shared with
+# the background workers, which keep sleeping for real
+_script_thread = threading.get_ident()
+_real_sleep = time.sleep
+_script_sleeps = []
+_sleep_patcher = None
+
+
+def _sleep(seconds):
+    if threading.get_ident() == _script_thread:
+        _script_sleeps.append(seconds)
+    else:
+        _real_sleep(seconds)
+
+
+def setUpModule():
+    global _test_db, _get_conn_patcher, _sleep_patcher
+    _sleep_patcher = patch('functions.time.sleep', _sleep)
+    _sleep_patcher.start()
+    _test_db = sqlite3.connect(_TEST_DB_URI, uri=True, check_same_thread=False, isolation_level=None)
+    _test_db.row_factory = sqlite3.Row
+    # Nothing a test runs ever reaches patients.db
+    _get_conn_patcher = patch('functions.get_conn', return_value=_test_db)
+    _get_conn_patcher.start()
+    init_db.clear()
+    init_db()
+    init_db.clear()
+
+
+def tearDownModule():
+    _sleep_patcher.stop()
+    _get_conn_patcher.stop()
+    _test_db.close()
 
 
 class TestFunctions(unittest.TestCase):
 
-    @patch('sqlite3.connect')
-    def test_init_db(self, mock_connect):
-        """ Test initialization of database. """
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
+    def tearDown(self):
+        _script_sleeps.clear()
+        # Nothing queued by a test may reach the real database or Sheets at exit
+        while not functions._log_queue.empty():
+            functions._log_queue.get_nowait()
+        while not functions._scan_queue.empty():
+            functions._scan_queue.get_nowait()
+        functions._sheets_down_until = float('-inf')
+        while not functions._patient_sync_queue.empty():
+            functions._patient_sync_queue.get_nowait()
+        functions._patient_sync_latest.clear()
+        _patient_sheet_rows.clear()
+        functions._db_rows_cache.clear()
+
+    def use_memory_db(self, setup_sql=None):
+        """ Returns the module's test database emptied, or a private one built on top of `setup_sql`. """
+        if setup_sql is None:
+            _test_db.executescript('''
+                DELETE FROM scan_activities;
+                DELETE FROM logs;
+                DELETE FROM patients;
+                DELETE FROM sqlite_sequence;
+                UPDATE sync_state SET last_id = 0;
+            ''')
+            return _test_db
+        conn = sqlite3.connect(':memory:', check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        self.addCleanup(conn.close)
+        conn.executescript(setup_sql)
+        patcher = patch('functions.get_conn', return_value=conn)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        init_db.clear()
+        self.addCleanup(init_db.clear)
         init_db()
-        mock_connect.assert_called_once_with('patients.db')
-        mock_conn.cursor().execute.assert_called_once()
+        return conn
 
     @patch('sqlite3.connect')
-    def test_log_event(self, mock_connect):
-        """ Test logging events to the database. """
-        mock_conn = MagicMock()
+    def test_get_conn(self, mock_connect):
+        """ Test that a single shared connection is opened and reused. """
+        mock_conn = MagicMock(spec=sqlite3.Connection)
         mock_connect.return_value = mock_conn
+        get_conn.clear()
+        self.assertIs(get_conn(), mock_conn)
+        self.assertIs(get_conn(), mock_conn)
+        mock_connect.assert_called_once_with(
+            'patients.db', check_same_thread=False, isolation_level=None)
+        self.assertIn('journal_mode=WAL', mock_conn.executescript.call_args[0][0])
+        self.assertIs(mock_conn.row_factory, sqlite3.Row)
+        get_conn.clear()
+
+        # A connection whose setup fails is closed, and the error reaches the caller
+        mock_conn.executescript.side_effect = sqlite3.OperationalError("database is locked")
+        with self.assertRaises(sqlite3.OperationalError):
+            get_conn()
+        mock_conn.close.assert_called_once()
+        get_conn.clear()
+
+    def test_init_db(self):
+        """ Test initialization of database. """
+        conn = self.use_memory_db()
+        # Re-running on an existing schema is a no-op
+        init_db.clear()
+        self.addCleanup(init_db.clear)
+        init_db()
+        schema = {(row['type'], row['name']) for row in conn.execute('SELECT type, name FROM sqlite_master')}
+        for table in ('patients', 'scan_activities', 'logs', 'sync_state'):
+            self.assertIn(('table', table), schema)
+        for index in ('idx_scan_uuid', 'idx_logs_timestamp'):
+            self.assertIn(('index', index), schema)
+        for view in ('patient_allergies', 'patient_medical_history'):
+            self.assertIn(('view', view), schema)
+        self.assertEqual(tuple(conn.execute('SELECT name, last_id FROM sync_state').fetchone()), ('logs', 0))
+
+    @patch('functions._start_log_sync')
+    def test_init_db_failure_not_cached(self, _mock_start_log_sync):
+        """ Test that a failed initialization is raised and retried on the next call. """
+        conn = self.use_memory_db()
+        init_db.clear()
+        self.addCleanup(init_db.clear)
+        locked = MagicMock(spec=sqlite3.Connection)
+        locked.execute.side_effect = sqlite3.OperationalError("database is locked")
+        with patch('functions.get_conn', return_value=locked):
+            with self.assertRaises(sqlite3.OperationalError):
+                init_db()
+        self.assertEqual(functions._log_queue.get_nowait()[1:],
+                         ('ERROR', 'An error occurred during database initialization: database is locked'))
+
+        # Nothing was cached, so the next call initializes the database
+        conn.execute('DROP TABLE sync_state')
+        init_db()
+        self.assertIsNotNone(conn.execute("SELECT last_id FROM sync_state WHERE name = 'logs'").fetchone())
+
+    def test_init_db_migration(self):
+        """ Test that a database without the markdown columns is migrated in place. """
+        conn = self.use_memory_db('''
+            CREATE TABLE patients (id INTEGER PRIMARY KEY AUTOINCREMENT, uuid TEXT UNIQUE, name TEXT,
+                                   age INTEGER, nin TEXT UNIQUE, phone TEXT UNIQUE, emergency_contact TEXT,
+                                   genotype TEXT, blood_type TEXT, allergies TEXT, medical_history TEXT,
+                                   patient_id TEXT UNIQUE, qr_link TEXT);
+            INSERT INTO patients (uuid, allergies, medical_history) VALUES ('uuid', 'Peanuts,Sulfa', '');
+        ''')
+        row = conn.execute('SELECT allergies_md, medical_history_md FROM patients').fetchone()
+        self.assertEqual(tuple(row), ("- Peanuts\n- Sulfa", ""))
+        self.assertEqual([row['value'] for row in conn.execute('SELECT value FROM patient_allergies')], ['Peanuts', 'Sulfa'])
+
+    @patch.multiple('functions', get_conn=DEFAULT, _start_log_sync=DEFAULT)
+    def test_log_event(self, **mocks):
+        """ Test that logging an event only queues it for the background worker. """
         log_event('INFO', 'Test log message')
-        mock_connect.assert_called_once_with('patients.db')
-        mock_conn.cursor().execute.assert_called_once_with(
-            'INSERT INTO logs (level, message) VALUES (?, ?)', ('INFO', 'Test log message'))
+        # The database write and the Sheets sync both happen off the request path
+        mocks['get_conn'].assert_not_called()
+        mocks['_start_log_sync'].assert_called_once()
+        self.assertEqual(functions._log_queue.get_nowait(), (ANY, 'INFO', 'Test log message'))
+
+    @patch.multiple('functions', _sheet_id=DEFAULT, fetch_and_update_logs=DEFAULT, _open_worksheet=DEFAULT)
+    def test_sync_log_batch(self, **mocks):
+        """ Test that a drained batch is written in one transaction, then synced to Sheets. """
+        mocks['_sheet_id'].return_value = 'dummy_sheet_id'
+        conn = self.use_memory_db()
+        events = [('ts', 'INFO', 'first'), ('ts', 'ERROR', 'second')]
+        functions._sync_log_batch(events)
+        self.assertEqual([tuple(row) for row in conn.execute('SELECT timestamp, level, message FROM logs')], events)
+        self.assertFalse(conn.in_transaction)
+        mocks['fetch_and_update_logs'].assert_called_once_with(mocks['_open_worksheet'].return_value)
+
+    def test_fetch_and_update_logs(self):
+        """ Test that only rows above the high-water mark are appended, then the mark advances. """
+        conn = self.use_memory_db()
+        conn.executemany('INSERT INTO logs (timestamp, level, message) VALUES (?, ?, ?)',
+                         [('ts', 'INFO', f'old {i}') for i in range(4)] + [('ts', 'INFO', 'first'), ('ts', 'ERROR', None)])
+        conn.execute("UPDATE sync_state SET last_id = 4 WHERE name = 'logs'")
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+        fetch_and_update_logs(mock_worksheet)
+        mock_worksheet.append_rows.assert_called_once_with(
+            [[5, 'ts', 'INFO', 'first'], [6, 'ts', 'ERROR', '']], value_input_option='RAW')
+        self.assertEqual(conn.execute("SELECT last_id FROM sync_state WHERE name = 'logs'").fetchone()[0], 6)
+        mock_worksheet.clear.assert_not_called()
+
+        # Nothing new since the mark: no Sheets call at all
+        mock_worksheet.reset_mock()
+        fetch_and_update_logs(mock_worksheet)
+        mock_worksheet.append_rows.assert_not_called()
+
+    @patch('functions.LOG_SYNC_INTERVAL', 0.01)
+    def test_collect_log_batch(self):
+        """ Test that queued log rows are shipped to the Google Sheet as one batch. """
+        for i in range(3):
+            functions._log_queue.put([i, 'ts', 'INFO', f'message {i}'])
+        batch = functions._collect_log_batch()
+        self.assertEqual([row[0] for row in batch], [0, 1, 2])
+        self.assertTrue(functions._log_queue.empty())
+
+    def test_run_batches(self):
+        """ Test that a stopped worker hands over the batch it is still collecting. """
+        source, handled = functions.queue.Queue(), []
+        worker = threading.Thread(target=functions._run_batches, args=(source, 10, 60, handled.append))
+        worker.start()
+        functions._WORKERS[source] = worker
+        source.put('first')
+        source.put('second')
+        functions._stop_worker(source)
+        self.assertFalse(worker.is_alive())
+        self.assertEqual(handled, [['first', 'second']])
+        self.assertEqual(functions._drain(source), [])
 
-    @patch('functions.gspread.authorize')
-    @patch('functions.ServiceAccountCredentials.from_json_keyfile_name')
+    @patch('functions.gspread.authorize', autospec=True)
+    @patch('functions.ServiceAccountCredentials.from_json_keyfile_name', autospec=True)
     def test_connect_to_google_sheet(self, mock_credentials, mock_authorize):
         """ Test connecting to Google Sheets. """
-        mock_client = MagicMock()
+        mock_client = MagicMock(spec=gspread.Client)
         mock_authorize.return_value = mock_client
-        mock_worksheet = MagicMock()
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
         mock_client.open_by_key.return_value.worksheet.return_value = mock_worksheet
 
+        for cached in (_gspread_client, _open_spreadsheet, _open_worksheet):
+            cached.clear()
+
         sheet_id = "dummy_sheet_id"
         sheet_name = "dummy_sheet_name"
+
+        # A missing key file is reported and not cached, so the next call authorizes afresh
+        mock_credentials.side_effect = FileNotFoundError('mainCredentials.json')
+        self.assertIsNone(connect_to_google_sheet(sheet_id, sheet_name))
+        mock_authorize.assert_not_called()
+        mock_credentials.side_effect = None
+        mock_credentials.reset_mock()
+
         result = connect_to_google_sheet(sheet_id, sheet_name)
         self.assertEqual(result, mock_worksheet)
 
-    @patch('sqlite3.connect')
-    def test_fetch_db_data(self, mock_connect):
+        # A second lookup reuses the cached, already-authorized client
+        connect_to_google_sheet(sheet_id, "other_sheet_name")
+        mock_credentials.assert_called_once_with('mainCredentials.json', ANY)
+        mock_authorize.assert_called_once_with(mock_credentials.return_value)
+        mock_client.open_by_key.assert_called_once_with(sheet_id)
+
+        # Expiring the worksheet handles reopens the sheet without re-reading the credentials
+        _open_spreadsheet.clear()
+        _open_worksheet.clear()
+        connect_to_google_sheet(sheet_id, sheet_name)
+        mock_credentials.assert_called_once()
+        mock_authorize.assert_called_once()
+        self.assertEqual(mock_client.open_by_key.call_count, 2)
+
+    @patch('functions._open_worksheet')
+    def test_sheets_circuit_breaker(self, mock_open_worksheet):
+        """ Test that an outage opens the breaker and Sheets calls are skipped until it closes. """
+        mock_open_worksheet.side_effect = OSError("timed out")
+        self.assertIsNone(connect_to_google_sheet("dummy_sheet_id", "Patients"))
+        self.assertFalse(functions.sheets_available())
+
+        # While the breaker is open no Sheets call is attempted
+        mock_open_worksheet.reset_mock()
+        self.assertIsNone(connect_to_google_sheet("dummy_sheet_id", "Patients"))
+        mock_open_worksheet.assert_not_called()
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+        update_google_sheet_from_db(mock_worksheet, "SELECT * FROM patients")
+        mock_worksheet.spreadsheet.batch_update.assert_not_called()
+
+        # Errors that are not outages leave the breaker closed
+        functions._sheets_down_until = float('-inf')
+        functions._record_sheets_failure(ValueError("bad row"))
+        self.assertTrue(functions.sheets_available())
+
+    @patch.multiple('functions', _sheet_id=DEFAULT, _start_log_sync=DEFAULT, fetch_db_rows=DEFAULT,
+                    _open_worksheet=DEFAULT)
+    def test_reconcile_google_sheets(self, **mocks):
+        """ Test that the reconcile rewrites each mirrored sheet in full and forgets cached rows. """
+        mocks['_sheet_id'].return_value = 'dummy_sheet_id'
+        # The snapshot is read with the sheet write lock already held, so no incremental
+        # append can land between the read and the rewrite
+        lock_free_during_read = []
+
+        def probe_lock():
+            acquired = functions._SHEET_WRITE_LOCK.acquire(blocking=False)
+            if acquired:
+                functions._SHEET_WRITE_LOCK.release()
+            lock_free_during_read.append(acquired)
+
+        def read_snapshot(query):
+            probe = threading.Thread(target=probe_lock)
+            probe.start()
+            probe.join()
+            return ['id', 'uuid'], [(1, 'uuid1'), (2, None)]
+
+        mocks['fetch_db_rows'].side_effect = read_snapshot
+        mock_open_worksheet = mocks['_open_worksheet']
+        mock_worksheet = mock_open_worksheet.return_value
+        mock_worksheet.row_count, mock_worksheet.col_count = 1000, 26
+        _patient_sheet_rows()[(mock_worksheet.id, 'uuid1')] = 5
+        functions.reconcile_google_sheets()
+        self.assertEqual([c[0] for c in mock_open_worksheet.call_args_list],
+                         [('dummy_sheet_id', 'Patients'), ('dummy_sheet_id', 'Scan Activities')])
+        self.assertEqual(mock_worksheet.spreadsheet.batch_update.call_count, 2)
+        rows = mock_worksheet.spreadsheet.batch_update.call_args[0][0]['requests'][-1]['updateCells']['rows']
+        self.assertEqual(rows[2], {'values': [{'userEnteredValue': {'numberValue': 2}}, {}]})
+        self.assertEqual(_patient_sheet_rows(), {})
+        self.assertEqual(lock_free_during_read, [False, False])
+
+    def test_fetch_db_data(self):
         """ Test fetching data from the SQLite database. """
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
-        mock_cursor = mock_conn.cursor()
-        mock_cursor.execute.return_value.fetchall.return_value = [
-            (1, 'John Doe', 30)]
+        conn = self.use_memory_db()
+        conn.execute("INSERT INTO patients (name, age) VALUES ('John Doe', 30)")
 
-        query = "SELECT * FROM patients"
-        result = fetch_db_data(query)
+        # The one end-to-end DataFrame check; pandas is only loaded by this test, as in the app
+        import pandas as pd
+        result = fetch_db_data("SELECT id, name, age FROM patients")
         self.assertIsInstance(result, pd.DataFrame)
-        self.assertEqual(result.iloc[0, 1], 'John Doe')
-        mock_connect.assert_called_once_with('patients.db')
+        self.assertEqual(list(result.columns), ['id', 'name', 'age'])
+        self.assertEqual(list(result.itertuples(index=False, name=None)), [(1, 'John Doe', 30)])
 
-    @patch('sqlite3.connect')
-    @patch('functions.update_google_sheet_from_db')
-    def test_log_scan_activity(self, mock_update_google_sheet, mock_connect):
-        """ Test logging scan activities without IP. """
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
-        mock_scan_worksheet = MagicMock()
-        log_scan_activity('dummy_uuid', mock_scan_worksheet)
-        mock_connect.assert_called_once_with('patients.db')
-        mock_conn.cursor().execute.assert_called_once_with(
-            'INSERT INTO scan_activities (patient_uuid) VALUES (?)', ('dummy_uuid',))
-        mock_update_google_sheet.assert_called_once_with(mock_conn)
-
-    @patch('os.makedirs')
-    def test_create_qr_code(self, mock_makedirs):
+        # Callers that only read fields can skip building the DataFrame
+        columns, rows = fetch_db_data("SELECT id, name, age FROM patients", as_dataframe=False)
+        self.assertEqual(columns, ['id', 'name', 'age'])
+        self.assertEqual([tuple(row) for row in rows], [(1, 'John Doe', 30)])
+
+    def test_fetch_db_rows(self):
+        """ Test fetching raw rows and column names from the SQLite database. """
+        conn = self.use_memory_db()
+        conn.execute("INSERT INTO patients (name) VALUES ('John Doe')")
+
+        columns, rows = fetch_db_rows("SELECT id, name FROM patients")
+        self.assertEqual(columns, ['id', 'name'])
+        self.assertEqual([tuple(row) for row in rows], [(1, 'John Doe')])
+        # A bad query is reported instead of raised
+        self.assertIsNone(fetch_db_rows("SELECT missing FROM patients"))
+
+    def test_fetch_db_rows_cache(self):
+        """ Test that repeated reads reuse the result until the database changes. """
+        conn = self.use_memory_db()
+        conn.execute("INSERT INTO patients (name) VALUES ('John Doe')")
+
+        query = "SELECT id, name FROM patients"
+        first = fetch_db_rows(query)
+        self.assertIs(fetch_db_rows(query), first)
+
+        conn.execute("INSERT INTO patients (name) VALUES ('Jane Doe')")
+        expected = [(1, 'John Doe'), (2, 'Jane Doe')]
+        self.assertEqual([tuple(row) for row in fetch_db_rows(query)[1]], expected)
+
+        # A read issued while another thread's transaction is open waits for it, so rows that
+        # transaction rolls back are never cached
+        in_transaction = threading.Event()
+
+        def rolled_back_write():
+            with self.assertRaises(sqlite3.IntegrityError):
+                with functions.transaction() as write_conn:
+                    write_conn.execute("INSERT INTO patients (name) VALUES ('Rolled Back')")
+                    in_transaction.set()
+                    time.sleep(0.1)
+                    raise sqlite3.IntegrityError("rolled back")
+
+        writer = threading.Thread(target=rolled_back_write)
+        writer.start()
+        in_transaction.wait()
+        self.assertEqual([tuple(row) for row in fetch_db_rows(query)[1]], expected)
+        writer.join()
+        self.assertEqual([tuple(row) for row in fetch_db_rows(query)[1]], expected)
+
+    @patch('functions.fetch_db_rows')
+    def test_update_google_sheet_from_db(self, mock_fetch_db_rows):
+        """ Test that an unchanged table is not uploaded to the Google Sheet twice. """
+        mock_fetch_db_rows.return_value = (['id', 'uuid', 'name'], [(1, 'uuid', None)])
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+        mock_worksheet.id = 'test_update_google_sheet_from_db'
+        mock_worksheet.row_count, mock_worksheet.col_count = 1000, 26
+        mock_batch_update = mock_worksheet.spreadsheet.batch_update
+
+        update_google_sheet_from_db(mock_worksheet, "SELECT * FROM patients")
+        update_google_sheet_from_db(mock_worksheet, "SELECT * FROM patients")
+        # The clear and the upload go out as a single batchUpdate request
+        mock_batch_update.assert_called_once_with({'requests': [{'updateCells': {
+            'range': {'sheetId': mock_worksheet.id, 'startRowIndex': 0},
+            'rows': [
+                {'values': [{'userEnteredValue': {'stringValue': v}} for v in ('id', 'uuid', 'name')]},
+                {'values': [{'userEnteredValue': {'numberValue': 1}}, {'userEnteredValue': {'stringValue': 'uuid'}}, {}]},
+            ],
+            'fields': 'userEnteredValue'}}]})
+        mock_worksheet.clear.assert_not_called()
+
+        mock_fetch_db_rows.return_value = (['id', 'uuid', 'name'], [(1, 'uuid', 'Jane Doe')])
+        update_google_sheet_from_db(mock_worksheet, "SELECT * FROM patients")
+        self.assertEqual(mock_batch_update.call_count, 2)
+
+        # A table larger than the grid grows the sheet in the same request
+        mock_worksheet.row_count = 1
+        update_google_sheet_from_db(mock_worksheet, "SELECT * FROM logs")
+        requests = mock_batch_update.call_args[0][0]['requests']
+        self.assertEqual(requests[0]['updateSheetProperties']['properties']['gridProperties']['rowCount'], 2)
+
+        # Larger tables go out in chunks; only the last range is left open to clear the rest
+        mock_batch_update.reset_mock()
+        mock_fetch_db_rows.return_value = (['id', 'uuid', 'name'], [(1, 'uuid', 'Jane Doe'), (2, 'uuid2', None)])
+        with patch('functions.SHEET_REWRITE_CHUNK_ROWS', 2):
+            update_google_sheet_from_db(mock_worksheet, "SELECT * FROM patients")
+        ranges = [call[0][0]['requests'][-1]['updateCells']['range'] for call in mock_batch_update.call_args_list]
+        self.assertEqual(ranges, [{'sheetId': mock_worksheet.id, 'startRowIndex': 0, 'endRowIndex': 2},
+                                  {'sheetId': mock_worksheet.id, 'startRowIndex': 2}])
+
+    @patch('functions._start_scan_sync')
+    def test_log_scan_activity(self, mock_start_scan_sync):
+        """ Test that a scan is queued for the background writer without touching SQLite. """
+        mock_scan_worksheet = MagicMock(spec=gspread.Worksheet)
+        with patch('functions.transaction') as mock_transaction:
+            log_scan_activity('dummy_uuid', mock_scan_worksheet)
+            mock_transaction.assert_not_called()
+        mock_start_scan_sync.assert_called_once()
+        self.assertEqual(functions._scan_queue.get_nowait(), (mock_scan_worksheet, ('dummy_uuid', ANY)))
+
+    @patch.multiple('functions', _start_log_sync=DEFAULT, update_google_sheet_from_db=DEFAULT)
+    def test_flush_scan_activities(self, **mocks):
+        """ Test that queued scans are written in one transaction and appended per worksheet. """
+        conn = self.use_memory_db()
+        conn.execute("INSERT INTO scan_activities (patient_uuid, timestamp) VALUES ('uuid0', 't0')")
+        mock_scan_worksheet = MagicMock(spec=gspread.Worksheet)
+
+        flush_scan_activities([(mock_scan_worksheet, ('uuid1', 't1')), (None, ('uuid2', 't2'))])
+        self.assertEqual([tuple(row) for row in conn.execute('SELECT * FROM scan_activities WHERE id > 1')],
+                         [(2, 'uuid1', 't1'), (3, 'uuid2', 't2')])
+        # Only the new rows are appended, with their SQLite ids; the sheet is never rewritten
+        mock_scan_worksheet.append_rows.assert_called_once_with(
+            [[2, 'uuid1', 't1']], value_input_option='RAW')
+        mocks['update_google_sheet_from_db'].assert_not_called()
+
+        # A failed write keeps the scans queued for the next flush
+        conn.execute("CREATE TEMP TRIGGER fail_scan BEFORE INSERT ON scan_activities "
+                     "BEGIN SELECT RAISE(ABORT, 'database is locked'); END")
+        self.addCleanup(conn.execute, 'DROP TRIGGER fail_scan')
+        flush_scan_activities([(mock_scan_worksheet, ('uuid3', 't3'))])
+        self.assertEqual(functions._scan_queue.get_nowait(), (mock_scan_worksheet, ('uuid3', 't3')))
+
+    def test_upsert_patient_row_in_sheet(self):
+        """ Test that an existing patient row is updated in place and a new one appended. """
+        row = (1, 'uuid', 'John Doe', 25)
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+        mock_worksheet.col_values.return_value = ['uuid_header', 'other', 'uuid']
+        upsert_patient_row_in_sheet(mock_worksheet, row)
+        mock_worksheet.col_values.assert_called_once_with(2)
+        mock_worksheet.batch_update.assert_called_once_with(
+            [{'range': 'A3:D3', 'values': [list(row)]}], value_input_option='RAW')
+        mock_worksheet.append_rows.assert_not_called()
+
+        # The row number is cached, so a repeat update skips the lookup
+        mock_worksheet.reset_mock()
+        upsert_patient_row_in_sheet(mock_worksheet, row)
+        mock_worksheet.col_values.assert_not_called()
+        mock_worksheet.batch_update.assert_called_once()
+
+        _patient_sheet_rows.clear()
+        mock_worksheet.reset_mock()
+        mock_worksheet.col_values.return_value = ['uuid_header']
+        mock_worksheet.append_rows.return_value = {'updates': {'updatedRange': "'Patients'!A5:D5"}}
+        upsert_patient_row_in_sheet(mock_worksheet, row)
+        mock_worksheet.append_rows.assert_called_once_with([list(row)], value_input_option='RAW')
+        self.assertEqual(_patient_sheet_rows()[(mock_worksheet.id, 'uuid')], 5)
+
+    @patch.multiple('functions', _start_log_sync=DEFAULT, _start_patient_sync=DEFAULT)
+    def test_sync_patient_batch(self, **_mocks):
+        """ Test that queued rows are coalesced per patient and sent in one call per worksheet. """
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+        mock_worksheet.col_values.return_value = ['uuid_header', 'uuid1', 'uuid3']
+        mock_worksheet.append_rows.return_value = {'updates': {'updatedRange': "'Patients'!A4:C4"}}
+        for row in [(1, 'uuid1', 'old name'), (2, 'uuid2', 'Jane Doe'), (3, 'uuid3', 'Ada Obi'),
+                    (1, 'uuid1', 'new name')]:
+            functions.queue_patient_sheet_sync(mock_worksheet, row)
+        functions._sync_patient_batch(functions._drain(functions._patient_sync_queue))
+        mock_worksheet.col_values.assert_called_once_with(2)
+        # Every existing row is rewritten by the same request, never one call per row
+        mock_worksheet.batch_update.assert_called_once_with(
+            [{'range': 'A3:C3', 'values': [[3, 'uuid3', 'Ada Obi']]},
+             {'range': 'A2:C2', 'values': [[1, 'uuid1', 'new name']]}], value_input_option='RAW')
+        mock_worksheet.append_rows.assert_called_once_with([[2, 'uuid2', 'Jane Doe']], value_input_option='RAW')
+        mock_worksheet.update.assert_not_called()
+        mock_worksheet.update_cell.assert_not_called()
+        self.assertEqual(_patient_sheet_rows()[(mock_worksheet.id, 'uuid2')], 4)
+
+    @patch.multiple('functions', _start_log_sync=DEFAULT, _start_patient_sync=DEFAULT)
+    def test_sync_patient_batch_requeue(self, **_mocks):
+        """ Test that a row requeued after an outage never overwrites a newer one queued meanwhile. """
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+        _patient_sheet_rows()[(mock_worksheet.id, 'uuid1')] = 2
+        functions.queue_patient_sheet_sync(mock_worksheet, (1, 'uuid1', 'v1'))
+        failed_batch = functions._drain(functions._patient_sync_queue)
+
+        # v2 is queued while the v1 call is failing, so the retry holds [v2, v1]
+        def outage(*args, **kwargs):
+            functions.queue_patient_sheet_sync(mock_worksheet, (1, 'uuid1', 'v2'))
+            raise OSError("timed out")
+
+        mock_worksheet.batch_update.side_effect = outage
+        functions._sync_patient_batch(failed_batch)
+        retry = functions._drain(functions._patient_sync_queue)
+        self.assertEqual([row[2] for _, row, _ in retry], ['v2', 'v1'])
+
+        functions._sheets_down_until = float('-inf')
+        mock_worksheet.batch_update.reset_mock(side_effect=True)
+        functions._sync_patient_batch(retry)
+        mock_worksheet.batch_update.assert_called_once_with(
+            [{'range': 'A2:C2', 'values': [[1, 'uuid1', 'v2']]}], value_input_option='RAW')
+
+    def test_create_qr_code(self):
         """ Test QR code generation with the correct path and data. """
-        mock_file_path = "dummy/path/qr_code.png"
-        data = "https://example.com"
-        mock_makedirs.return_value = None
-        result = create_qr_code(data, mock_file_path)
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "dummy", "path", "qr_code.png")
+            result = create_qr_code("https://example.com", file_path)
+            self.assertIsInstance(result, BytesIO)
+            self.assertTrue(result.getvalue().startswith(b'\x89PNG'))
+            # The missing directories are created and the same bytes persisted, under a name
+            # carrying the payload's hash; no temporary file is left behind
+            saved_path = functions._qr_file_path(file_path, "https://example.com")
+            self.assertRegex(saved_path, r'qr_code_[0-9a-f]{8}\.png$')
+            self.assertEqual(os.listdir(os.path.dirname(file_path)), [os.path.basename(saved_path)])
+            with open(saved_path, 'rb') as f:
+                self.assertEqual(f.read(), result.getvalue())
+
+            # A failed write is reported, leaves nothing on disk and still returns the PNG
+            other_path = os.path.join(directory, "other", "qr_code.png")
+            with patch('functions.os.replace', side_effect=OSError("No space left on device")):
+                self.assertEqual(create_qr_code("https://example.com", other_path).getvalue(), result.getvalue())
+            self.assertEqual(os.listdir(os.path.dirname(other_path)), [])
+
+    @patch('functions._qr_png_bytes')
+    def test_create_qr_code_existing_file(self, mock_qr_png_bytes):
+        """ Test that a QR code already saved on disk is returned without re-encoding. """
+        mock_qr_png_bytes.return_value = b'\x89PNG saved'
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, "QR Codes", "qr_code.png")
+            saved = create_qr_code("https://example.com", file_path).getvalue()
+            mock_qr_png_bytes.assert_called_once()
+
+            mock_qr_png_bytes.reset_mock()
+            result = create_qr_code("https://example.com", file_path)
+            self.assertEqual(result.getvalue(), saved)
+            mock_qr_png_bytes.assert_not_called()
+
+            # A different link (e.g. a new host) is encoded afresh, not served the old file
+            mock_qr_png_bytes.return_value = b'\x89PNG new host'
+            result = create_qr_code("https://new.example.com", file_path)
+            self.assertEqual(result.getvalue(), b'\x89PNG new host')
+            mock_qr_png_bytes.assert_called_once()
+
+    @patch('functions.open', create=True)
+    def test_create_qr_code_in_memory(self, mock_open):
+        """ Test QR code generation without persisting the PNG to disk. """
+        result = create_qr_code("https://example.com")
         self.assertIsInstance(result, BytesIO)
+        self.assertTrue(result.getvalue().startswith(b'\x89PNG'))
+        mock_open.assert_not_called()
+
+        # The same payload is served from the encode cache
+        hits = functions._qr_png_bytes.cache_info().hits
+        self.assertEqual(create_qr_code("https://example.com").getvalue(), result.getvalue())
+        self.assertEqual(functions._qr_png_bytes.cache_info().hits, hits + 1)
 
     def test_validate_phone_and_emergency_contact(self):
         """ Test validation to ensure phone number and emergency contact are not the same. """
-        phone = "+2341234567890"
-        emergency_contact = "+2340987654321"
-        result = validate_phone_and_emergency_contact(phone, emergency_contact)
-        self.assertTrue(result)
-        result_fail = validate_phone_and_emergency_contact(phone, phone)
-        self.assertFalse(result_fail)
+        # Both numbers reach this check already normalized to +234 form
+        cases = [
+            ("+2341234567890", "+2340987654321", True),
+            ("+2341234567890", "+2341234567890", False),
+        ]
+        for phone, emergency_contact, expected in cases:
+            with self.subTest(phone=phone, emergency_contact=emergency_contact):
+                self.assertIs(validate_phone_and_emergency_contact(phone, emergency_contact), expected)
 
     def test_validate_nin(self):
-        """ Test NIN validation to ensure it is 11 digits. """
-        valid_nin = "12345678901"
-        invalid_nin = "12345"
-        self.assertTrue(validate_nin(valid_nin))
-        self.assertFalse(validate_nin(invalid_nin))
+        """ Test NIN validation to ensure it is exactly 11 ASCII digits. """
+        cases = [
+            ("12345678901", True),
+            ("1" * 11, True),
+            ("", False),
+            ("12345", False),
+            ("1" * 10, False),
+            ("1" * 12, False),
+            ("1234567890a", False),
+            ("1234/678901", False),
+            ("1234567:901", False),
+            ("\u0661" * 11, False),  # Arabic-Indic digits are not ASCII
+        ]
+        for nin, expected in cases:
+            with self.subTest(nin=nin):
+                self.assertIs(validate_nin(nin), expected)
 
     def test_validate_phone(self):
-        """ Test phone number validation for Nigerian numbers. """
-        phone = "08123456789"
-        result = validate_phone(phone)
-        self.assertEqual(result, "+2348123456789")
-
-    def test_validate_emergency_contact(self):
-        """ Test emergency contact validation. """
-        emergency_contact = "07031234567"
-        result = validate_emergency_contact(emergency_contact)
-        self.assertEqual(result, "+2347031234567")
+        """ Test that phone and emergency contact numbers are normalized to +234 form. """
+        cases = [
+            ("08123456789", "+2348123456789"),
+            ("07031234567", "+2347031234567"),
+            ("8123456789", "+2348123456789"),
+            ("2348123456789", "+2348123456789"),
+            ("(0812) 345-6789", "+2348123456789"),
+            ("+234 812 345 6789", "+2348123456789"),
+            ("0812abc3456789", None),
+            ("0812\u00e93456789", None),
+            ("08123456789\u0663", None),
+            ("0812\xa03456789", None),
+            ("0+8123456789", None),
+            ("++2348123456789", None),
+            ("081234567890", None),
+            ("18123456789", None),
+            ("", None),
+        ]
+        for validator in (validate_phone, validate_emergency_contact):
+            for raw, expected in cases:
+                with self.subTest(validator=validator.__name__, raw=raw):
+                    self.assertEqual(validator(raw), expected)
 
-    @patch('sqlite3.connect')
-    def test_get_patient_by_id(self, mock_connect):
+    def test_get_patient_by_id(self):
         """ Test fetching patient by ID. """
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
-        mock_conn.cursor.return_value.fetchone.return_value = (
-            1, 'uuid', 'John Doe', 25)
+        conn = self.use_memory_db()
+        conn.execute("INSERT INTO patients (uuid, name, age, patient_id, allergies, allergies_md) "
+                     "VALUES ('uuid', 'John Doe', 25, 'PAT123', 'Peanuts', '- Peanuts')")
 
-        patient_id = "PAT123"
-        result = get_patient_by_id(patient_id)
+        result = get_patient_by_id("PAT123")
         self.assertIsNotNone(result)
-        self.assertEqual(result[2], 'John Doe')
+        self.assertEqual(result['name'], 'John Doe')
+        self.assertEqual(result['allergies_md'], '- Peanuts')
+        # The view reads the pre-rendered markdown, not the raw lists
+        self.assertNotIn('allergies', result.keys())
+        self.assertIsNone(get_patient_by_id("PAT999"))
 
-    @patch('sqlite3.connect')
-    def test_insert_or_update_patient(self, mock_connect):
+    @patch.multiple('functions', _start_log_sync=DEFAULT, _start_patient_sync=DEFAULT)
+    def test_insert_or_update_patient(self, **_mocks):
         """ Test inserting or updating a patient's information. """
-        mock_conn = MagicMock()
-        mock_connect.return_value = mock_conn
-        mock_worksheet = MagicMock()
-
-        name = "John Doe"
-        age = 25
-        nin = "12345678901"
-        phone = "+2341234567890"
-        emergency_contact = "+2340987654321"
-        genotype = "AA"
-        blood_type = "O+"
-        new_allergies = "Peanuts"
-        new_medical_history = "Asthma"
-        patient_id = "PAT123"
-        result = insert_or_update_patient(name, age, nin, phone, emergency_contact, genotype, blood_type,
-                                          new_allergies, new_medical_history, patient_id, mock_worksheet, None)
-        self.assertIsNotNone(result)
-        mock_connect.assert_called_once_with('patients.db')
+        conn = self.use_memory_db()
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+
+        patient = DEFAULT_PATIENT
+        result = insert_or_update_patient(*astuple(patient), mock_worksheet, None)
+        self.assertEqual(result, functions.QR_LINK_TEMPLATE.format(patient_id=patient.patient_id))
+        # The sheet sync is queued for the background worker rather than done inline
+        mock_worksheet.batch_update.assert_not_called()
+        queued_worksheet, queued_row, _ = functions._patient_sync_queue.get_nowait()
+        self.assertIs(queued_worksheet, mock_worksheet)
+        self.assertEqual(tuple(queued_row)[2:4], (patient.name, patient.age))
+        patient_uuid = queued_row['uuid']
+
+        # The same NIN updates the existing patient in place and keeps its UUID
+        updated = replace(patient, name="John A. Doe", age=26, phone="+2341234567891", allergies="Peanuts, Sulfa")
+        insert_or_update_patient(*astuple(updated), mock_worksheet, None)
+        rows = conn.execute('SELECT uuid, name, age, phone, allergies, allergies_md FROM patients').fetchall()
+        self.assertEqual([tuple(row) for row in rows],
+                         [(patient_uuid, "John A. Doe", 26, patient.phone, "Peanuts,Sulfa", "- Peanuts\n- Sulfa")])
+        self.assertEqual(functions._patient_sync_queue.get_nowait()[1]['name'], "John A. Doe")
+
+    @patch.multiple('functions', _start_log_sync=DEFAULT, _start_patient_sync=DEFAULT)
+    def test_bulk_insert_patients(self, **_mocks):
+        """ Test that many patients are inserted with one executemany in one transaction. """
+        conn = self.use_memory_db()
+        mock_worksheet = MagicMock(spec=gspread.Worksheet)
+        patients = [
+            astuple(replace(DEFAULT_PATIENT, allergies="Peanuts, Peanuts")),
+            astuple(PatientInput("Jane Doe", 30, "12345678902", "+2341234567891", "+2340987654322", "AS", "A+",
+                                 "", "", "PAT124")),
+        ]
+        self.assertEqual(bulk_insert_patients(patients, mock_worksheet), 2)
+        rows = conn.execute('SELECT uuid, allergies, allergies_md FROM patients ORDER BY id').fetchall()
+        self.assertEqual([tuple(row)[1:] for row in rows], [("Peanuts", "- Peanuts"), ("", "")])
+        # Each patient gets its own version-4 UUID in hex form
+        self.assertNotEqual(rows[0]['uuid'], rows[1]['uuid'])
+        self.assertTrue(all(len(row['uuid']) == 32 and uuid.UUID(row['uuid']).version == 4 for row in rows))
+        self.assertFalse(conn.in_transaction)
+        # The rows read back for Sheets are exactly the ones just inserted
+        for patient_id in ("PAT123", "PAT124"):
+            queued_worksheet, queued_row, _ = functions._patient_sync_queue.get_nowait()
+            self.assertIs(queued_worksheet, mock_worksheet)
+            self.assertEqual(queued_row['patient_id'], patient_id)
 
-    # Bypass sleep for faster tests
-    @patch('functions.time.sleep', return_value=None)
-    def test_display_first_aid_guide_auto_scroll_with_manual(self, _mock_sleep):
-        """ Test the display of the first aid guide with auto-scroll. """
+    @patch('functions._start_log_sync')
+    def test_bulk_log_events(self, mock_start_log_sync):
+        """ Test that many events are queued for the background worker in one call. """
+        bulk_log_events([("INFO", "first"), ("ERROR", "second")])
+        mock_start_log_sync.assert_called_once()
+        self.assertEqual(functions._log_queue.get_nowait(), (ANY, "INFO", "first"))
+        self.assertEqual(functions._log_queue.get_nowait(), (ANY, "ERROR", "second"))
+
+    def test_dedupe_and_clean(self):
+        """ Test that entries are stripped and deduped in the order they were typed. """
+        self.assertEqual(dedupe_and_clean(" Sulfa, Penicillin ,, Sulfa, Peanuts "), "Sulfa,Penicillin,Peanuts")
+        self.assertEqual(dedupe_and_clean(None), "")
+        self.assertEqual(dedupe_and_clean(" , "), "")
+        self.assertEqual(dedupe_and_clean("  Asthma "), "Asthma")
+        self.assertEqual(dedupe_and_clean("   "), "")
+
+    def test_format_bullet_list(self):
+        """ Test rendering comma-separated entries as a markdown list. """
+        self.assertEqual(format_bullet_list("Penicillin, , Peanuts "), "- Penicillin\n- Peanuts")
+        self.assertEqual(format_bullet_list(None), "")
+        self.assertEqual(format_bullet_list(" , "), "")
+
+    def test_load_first_aid_image(self):
+        """ Test that the first aid image is loaded as raw PNG bytes. """
+        image = load_first_aid_image()
+        self.assertIsInstance(image, bytes)
+        self.assertTrue(image.startswith(b'\x89PNG'))
+
+    @patch('functions.components.html')
+    def test_display_first_aid_guide_auto_scroll_with_manual(self, mock_html):
+        """ Test that the whole guide renders at once and scrolls in the browser. """
         with patch('streamlit.markdown') as mock_markdown:
             display_first_aid_guide_auto_scroll_with_manual()
             self.assertTrue(mock_markdown.called)
-
+            self.assertIn('STEPS TO GIVE CPR', mock_markdown.call_args_list[-1][0][0])
+        # The script thread is never put to sleep; the auto-scroll runs client-side
+        self.assertEqual(_script_sleeps, [])
+        self.assertIn('<script>', mock_html.call_args[0][0])
 
 if __name__ == "__main__":
     unittest.main()